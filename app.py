@@ -1,13 +1,60 @@
+import datetime
+import io
+import re
+
 import streamlit as st
-from generate_schedule import run
+from generate_schedule import run, load_roster, load_cached, file_key
+from generate_schedule import write_to_excel
+from generate_schedule import load_pref_table, pref_rules_from_table, save_pref_table
+from generate_schedule import cached_months, MERGE_CSV, VIOLATIONS_CSV, COMPLEMENT_CSV
+from generate_schedule import RULE_STATS_CSV
+from generate_schedule import load_pref_rules, MANIFEST_CSV, QUAL_CSV, STAFFING_CSV
+from schedule_index import edit_duty, search, whatif_copy
+from schedule_recolor import recolor
+from schedule_stats import QUAL_FIELDS, QUAL_HEADER, expiring_within, qual_rows
+from schedule_preview import (
+    color_lookup,
+    name_pages,
+    page_count,
+    page_href,
+    render_page_html,
+)
+from schedule_rules import cell_texts, rule_state, rule_stats
 
 st.title("スケジュール整形ツール")
 
+params = st.query_params
+views = {
+    "convert": "変換",
+    "preview": "プレビュー",
+    "search": "検索",
+    "quals": "資格期限",
+    "rules": "色ルール",
+}
+view = st.sidebar.radio(
+    "表示",
+    list(views.values()),
+    index=(
+        list(views).index(params.get("view", "convert"))
+        if params.get("view") in views
+        else 0
+    ),
+)
+
 # --- ファイルアップロード UI ---
 st.sidebar.header("入力ファイル")
-sched_file = st.sidebar.file_uploader("スケジュールCSVを選択", type=["csv"])
+sched_files = st.sidebar.file_uploader(
+    "スケジュールCSVを選択（複数可）", type=["csv"], accept_multiple_files=True
+)
+sched_file = sched_files[0] if len(sched_files) == 1 else sched_files
 emp_file = st.sidebar.file_uploader("職員番号CSVを選択", type=["csv"])
-pref_file = st.sidebar.file_uploader("設定ファイル（PERF.xlsx）を選択", type=["xlsx"])
+pref_file = st.sidebar.file_uploader(
+    "設定ファイル（PERF.xlsx / JSON / CSV）を選択", type=["xlsx", "json", "csv"]
+)
+onboard = st.sidebar.radio("同乗者の表示", ["日ごと", "トリップごと"], horizontal=True)
+onboard_layouts = {"1人1行": "rows", "1日1セル": "compact", "人数だけ": "count"}
+onboard_layout = st.sidebar.selectbox("同乗者の並べ方（Excel）", list(onboard_layouts))
+prev_month = st.sidebar.selectbox("前月（キャッシュ済み）", ["なし"] + cached_months())
 
 # --- 実行ボタン ---
 if st.sidebar.button("実行"):
@@ -15,9 +62,24 @@ if st.sidebar.button("実行"):
         st.sidebar.error("スケジュールCSVと職員番号CSVをアップロードしてください。")
     else:
         try:
-            csv_out, xlsx_out = run(sched_file, emp_file, pref_file)
+            csv_out, xlsx_out = run(
+                sched_file,
+                emp_file,
+                pref_file,
+                onboard="trip" if onboard == "トリップごと" else "day",
+                prev=None if prev_month == "なし" else prev_month,
+                onboard_layout=onboard_layouts[onboard_layout],
+            )
             st.success("処理が完了しました！")
 
+            # プレビュー用にキャッシュのキーを控えておく
+            # load_pref_rules がファイルのハッシュをキーにキャッシュへ保存する
+            pref_src = pref_file or "PREF.xlsx"
+            load_pref_rules(pref_src)
+            pref_key = file_key(pref_src)
+            st.session_state["roster_key"] = load_roster(sched_file, emp_file)["key"]
+            st.session_state["pref_key"] = pref_key
+
             # CSV ダウンロード
             with open(csv_out, "rb") as f_csv:
                 st.download_button(
@@ -34,5 +96,317 @@ if st.sidebar.button("実行"):
                     file_name=xlsx_out,
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 )
+            # 便別乗員リスト・資格期限・日別人数・勤務違反・編成不足・色ルールの統計
+            # （複数ファイルなら衝突一覧も）
+            extras = [
+                ("便別乗員", MANIFEST_CSV),
+                ("資格期限", QUAL_CSV),
+                ("日別人数", STAFFING_CSV),
+                ("勤務違反", VIOLATIONS_CSV),
+                ("編成不足", COMPLEMENT_CSV),
+                ("色ルール統計", RULE_STATS_CSV),
+            ]
+            if len(sched_files) > 1:
+                extras.append(("統合時の衝突", MERGE_CSV))
+            for label, path in extras:
+                with open(path, "rb") as f_extra:
+                    st.download_button(
+                        label=f"{label}CSVをダウンロード",
+                        data=f_extra,
+                        file_name=path,
+                        mime="text/csv",
+                    )
         except Exception as e:
             st.error(f"エラーが発生しました: {e}")
+
+# --- 色だけ付け直す（出力済みの Excel と PREF だけで動く） ---
+if view == "変換":
+    st.subheader("色の付け直し")
+    done_xlsx = st.file_uploader("出力済みのExcelを選択", type=["xlsx"])
+    if st.button("色だけ付け直す"):
+        if not done_xlsx:
+            st.error("出力済みのExcelをアップロードしてください。")
+        else:
+            try:
+                buf = io.BytesIO()
+                n = recolor(done_xlsx, load_pref_rules(pref_file or "PREF.xlsx"), buf)
+                st.success(f"{n}セルの色を付け直しました。")
+                st.download_button(
+                    label="色を付け直したExcelをダウンロード",
+                    data=buf.getvalue(),
+                    file_name=done_xlsx.name,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
+            except Exception as e:
+                st.error(f"エラーが発生しました: {e}")
+
+
+# --- プレビュー・検索 ---
+@st.cache_resource
+def cached_roster(roster_key):
+    return load_cached(roster_key)
+
+
+@st.cache_data
+def cached_name_pages(roster_key, page_size):
+    return name_pages(cached_roster(roster_key)["records"], page_size)
+
+
+# リンクで再読み込みされてもキャッシュから表示できるよう URL にキーを持たせる
+roster_key = params.get("key") or st.session_state.get("roster_key")
+pref_key = params.get("pref") or st.session_state.get("pref_key")
+roster = cached_roster(roster_key) if roster_key and view != "変換" else None
+rules = (load_cached(pref_key, kind="pref") if pref_key else None) or []
+# 色ルールの画面で編集中のルールがあればプレビューもそれで塗る
+rules = st.session_state.get("edited_rules", rules)
+if view != "変換" and not roster:
+    st.info("先に「実行」でスケジュールを読み込んでください。")
+
+if view == "プレビュー" and roster:
+    # What-if 編集中は複製した roster を表示する（キャッシュは書き換えない）
+    whatif_on = st.sidebar.checkbox("What-if 編集")
+    if whatif_on and st.session_state.get("whatif_key") != roster_key:
+        st.session_state["whatif"] = whatif_copy(roster)
+        st.session_state["whatif_key"] = roster_key
+    if whatif_on:
+        roster = st.session_state["whatif"]
+    records = roster["records"]
+    sizes = [10, 20, 50]
+    size = int(params.get("size", 20))
+    page_size = st.sidebar.selectbox(
+        "1ページの人数", sizes, index=sizes.index(size) if size in sizes else 1
+    )
+    pages = page_count(records, page_size)
+    page = st.sidebar.number_input(
+        "ページ",
+        min_value=1,
+        max_value=pages,
+        value=min(max(int(params.get("page", 1)), 1), pages),
+    )
+    link_params = {
+        "view": "preview",
+        "key": roster_key,
+        "pref": pref_key or "",
+        "size": str(page_size),
+    }
+    st.query_params.update(link_params, page=str(page))
+    st.caption(f"{len(records)}名中 {page}/{pages}ページ")
+    if whatif_on:
+        with st.expander("勤務の編集", expanded=True):
+            start = (page - 1) * page_size
+            shown = range(start, min(start + page_size, len(records)))
+            who = st.selectbox(
+                "乗員",
+                shown,
+                format_func=lambda i: f"{records[i]['hdr'][0]}（{records[i]['emp_no']}）",
+            )
+            labels = roster.get("dates") or records[0]["dr"]
+            day = st.selectbox(
+                "日付",
+                [d for d, label in enumerate(labels) if label],
+                format_func=lambda d: labels[d],
+            )
+            text = st.text_area(
+                "勤務（1行に1つ）",
+                "\n".join(records[who]["full_entries"][day]),
+                key=f"whatif-{who}-{day}",
+            )
+            if st.button("反映"):
+                affected = edit_duty(roster, who, day, text.splitlines())
+                st.caption(
+                    "同乗者を更新: " + " ".join(records[j]["hdr"][0] for j in affected)
+                )
+            if roster["edits"]:
+                st.dataframe(
+                    [
+                        {"職番": emp, "日付": labels[d], "勤務": " ".join(entries)}
+                        for emp, d, entries in roster["edits"]
+                    ]
+                )
+                if st.button("編集後のExcelを作成"):
+                    buf = io.BytesIO()
+                    write_to_excel(records, roster["emp_aff_map"], buf, rules)
+                    st.download_button(
+                        label="編集後のExcelをダウンロード",
+                        data=buf.getvalue(),
+                        file_name="formatted_schedule_whatif.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    )
+                if st.button("編集を取り消す"):
+                    st.session_state.pop("whatif_key", None)
+                    st.rerun()
+    st.markdown(
+        render_page_html(
+            records,
+            page - 1,
+            page_size,
+            color_lookup(rules),
+            roster["emp_aff_map"],
+            link_params,
+            cached_name_pages(roster_key, page_size),
+        ),
+        unsafe_allow_html=True,
+    )
+
+if view == "検索" and roster:
+    records = roster["records"]
+    days = [d for d in roster["search"]["dates"] if d]
+    text = st.text_input("職番・氏名・ローマ字・2レター・所属・便名（前方一致）")
+    day = st.selectbox("日付（便名のみ）", ["指定なし"] + days)
+    if text:
+        hits = search(
+            roster["search"], text, day=None if day == "指定なし" else day, limit=50
+        )
+        link_params = {"view": "preview", "key": roster_key, "pref": pref_key or ""}
+        pages = cached_name_pages(roster_key, 20)
+        st.caption(f"乗員 {len(hits['crew'])}件 / 便 {len(hits['flights'])}件")
+        if hits["flights"]:
+            st.dataframe(
+                [
+                    {
+                        "日付": roster["search"]["dates"][d],
+                        "便": tok,
+                        "職番": records[i]["emp_no"],
+                        "氏名": records[i]["hdr"][0],
+                        "所属": records[i]["aff"],
+                    }
+                    for tok, d, i in hits["flights"]
+                ]
+            )
+        color_of = color_lookup(rules)
+        for key, field, i in hits["crew"][:10]:
+            rec = records[i]
+            href = page_href(dict(link_params, size="20"), *pages[rec["hdr"][0]])
+            st.markdown(
+                f"[{rec['hdr'][0]}（{rec['emp_no']}）をプレビューで開く]({href})"
+            )
+            st.markdown(
+                render_page_html(
+                    [rec], 0, 1, color_of, roster["emp_aff_map"], link_params, pages
+                ),
+                unsafe_allow_html=True,
+            )
+
+if view == "資格期限" and roster:
+    records = roster["records"]
+    first_date = next((d for d in roster.get("dates", []) if d), None)
+    base_date = st.date_input(
+        "基準日",
+        (
+            datetime.date.fromisoformat(first_date)
+            if first_date
+            else datetime.date.today()
+        ),
+    )
+    within = st.number_input("何日以内", min_value=0, value=60)
+    kinds = st.multiselect("種別", list(QUAL_FIELDS), default=list(QUAL_FIELDS))
+    ranks = sorted(r for r in roster["avail"]["rank"] if r)
+    rank = st.selectbox("ランク", ["指定なし"] + ranks)
+    bases = sorted(b for b in roster["avail"]["base"] if b)
+    base = st.selectbox("所属", ["指定なし"] + bases)
+    hits = expiring_within(
+        roster["quals"],
+        records,
+        base_date.isoformat(),
+        int(within),
+        kinds,
+        None if rank == "指定なし" else rank,
+        None if base == "指定なし" else base,
+    )
+    st.caption(f"{len(hits)}件")
+    st.dataframe(
+        [
+            dict(zip(QUAL_HEADER, row))
+            for row in qual_rows(roster["quals"], records, hits)
+        ]
+    )
+
+
+@st.cache_data
+def cached_cell_texts(roster_key):
+    return cell_texts(cached_roster(roster_key)["records"])
+
+
+if view == "色ルール" and roster:
+    if "pref_table" not in st.session_state:
+        st.session_state["pref_table"] = load_pref_table(pref_file or "PREF.xlsx")
+    edited = st.data_editor(
+        st.session_state["pref_table"],
+        num_rows="dynamic",
+        column_config={
+            "enable": st.column_config.CheckboxColumn("有効", default=True),
+            "first": st.column_config.TextColumn("1行目"),
+            "op": st.column_config.SelectboxColumn(
+                "AND/OR", options=["AND", "OR", "NONE"]
+            ),
+            "second": st.column_config.TextColumn("2行目"),
+            "label": st.column_config.TextColumn("ラベル"),
+            "color": st.column_config.TextColumn("色", validate=r"^#?[0-9A-Fa-f]{6}$"),
+        },
+        key="pref_editor",
+    )
+    # 空欄は None / NaN で返ってくるので None にそろえる
+    table = [
+        {
+            "enable": bool(row.get("enable")),
+            **{
+                k: row.get(k) if isinstance(row.get(k), str) and row.get(k) else None
+                for k in ("first", "op", "second", "label")
+            },
+            "color": row.get("color") if isinstance(row.get("color"), str) else "",
+        }
+        for row in edited
+    ]
+    edited_rules = pref_rules_from_table(table)
+    bad = []
+    for rule in edited_rules:
+        for pattern in (rule["first"], rule["second"]):
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                bad.append(f"{rule['label']}: {pattern}（{e}）")
+    if bad:
+        st.error("正規表現の誤り: " + " / ".join(bad))
+    else:
+        st.session_state["edited_rules"] = edited_rules
+        texts = cached_cell_texts(roster_key)
+        stats = rule_stats(edited_rules, texts)
+        hits = stats["hits"]
+        st.caption(
+            f"異なる勤務 {len(texts)}種類 / セル {sum(texts.values())}件"
+            f" / ルールの評価 {sum(stats['evals'])}回"
+        )
+        st.dataframe(
+            [
+                {
+                    "ラベル": rule["label"],
+                    "色": rule["color"],
+                    "当たったセル": hits[k],
+                    "評価したセル": stats["evals"][k],
+                    "状態": rule_state(stats, k),
+                }
+                for k, rule in enumerate(edited_rules)
+            ]
+            + [{"ラベル": "（一致なし）", "色": "#DDDDDD", "当たったセル": hits[-1]}]
+        )
+        link_params = {"view": "preview", "key": roster_key, "pref": pref_key or ""}
+        st.markdown(
+            render_page_html(
+                roster["records"],
+                0,
+                5,
+                color_lookup(edited_rules),
+                roster["emp_aff_map"],
+                link_params,
+                cached_name_pages(roster_key, 20),
+            ),
+            unsafe_allow_html=True,
+        )
+        buf = io.BytesIO()
+        save_pref_table(table, buf)
+        st.download_button(
+            label="PREF.xlsx をダウンロード",
+            data=buf.getvalue(),
+            file_name="PREF.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
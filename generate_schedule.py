@@ -4,9 +4,70 @@
 import pandas as pd
 import re
 import csv
+import hashlib
+import io
+import json
+import os
+import pickle
 from openpyxl import Workbook
-from openpyxl.styles import Alignment, PatternFill, Border, Side
+from openpyxl.styles import Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.styles import DEFAULT_FONT
 from openpyxl.utils import get_column_letter
+from openpyxl.formatting.formatting import ConditionalFormatting
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.worksheet.hyperlink import Hyperlink
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+
+from schedule_rules import match_index, pattern_terms, rule_matcher
+from schedule_rules import RULE_STATS_HEADER, cell_texts, reorder_rules
+from schedule_rules import rule_stats, rule_stats_rows, total_evals
+from schedule_checks import (
+    VIOLATION_HEADER,
+    check_complement,
+    check_legality,
+    complement_header,
+    load_legality_rules,
+)
+from schedule_stats import (
+    DUTY_CLASSES,
+    QUAL_FIELDS,
+    QUAL_HEADER,
+    availability_mask,
+    build_availability,
+    build_pairing,
+    build_qual_index,
+    build_staffing,
+    crew_base,
+    expiring_within,
+    mask_members,
+    merge_pairing,
+    merge_totals,
+    month_totals,
+    pairs_above,
+    partners_between,
+    qual_rows,
+    rolling_totals,
+    staffing_header,
+    staffing_rows,
+    top_partners,
+)
+from schedule_index import (
+    MANIFEST_HEADER,
+    build_flight_index,
+    build_search_index,
+    build_trips,
+    day_dates,
+    day_index,
+    header_value,
+    manifest_links,
+    manifest_positions,
+    manifest_rows,
+    onboard_names,
+    search,
+    timeline_roster,
+    trip_onboard_names,
+)
 
 # ==== Helpers ====
 
@@ -73,10 +134,57 @@ def slice_blocks(df):
     return blocks
 
 
-def load_pref_rules(pref_file):
+PREF_HEADER = ["ENABLE", "FIRST ROW", "AND/OR", "SECOND ROW", "LABEL", "COLOR"]
+
+
+def _pref_text_rows(pref_file, kind):
+    # JSON: [{"enable", "first", "op", "second", "label", "color"}, ...]
+    # CSV : PREF.xlsx と同じ見出し（ENABLE, FIRST ROW, ..., COLOR="#RRGGBB"）。他の列は無視
+    text = _file_bytes(pref_file).decode("utf-8-sig")
+    if kind == "json":
+        items = json.loads(text)
+    else:
+        keys = dict(zip(PREF_HEADER, ("enable", "first", "op", "second", "label")))
+        keys["COLOR"] = "color"
+        # NOTE などの見出しにない列は読み飛ばす
+        items = [
+            {
+                keys[k.strip().upper()]: v
+                for k, v in row.items()
+                if k and k.strip().upper() in keys
+            }
+            for row in csv.DictReader(io.StringIO(text))
+        ]
+    rows = []
+    for item in items:
+        enable = item.get("enable", True)
+        if isinstance(enable, str):
+            enable = enable.strip().upper() in ("YES", "TRUE", "1")
+        color = (item.get("color") or "").strip().lstrip("#")
+        rows.append(
+            {
+                "enable": bool(enable),
+                **{
+                    k: item.get(k) if item.get(k) not in ("", None) else None
+                    for k in ("first", "op", "second", "label")
+                },
+                "color": f"#{color.upper()}" if color else "",
+            }
+        )
+    return rows
+
+
+def load_pref_table(pref_file):
+    # PREF.xlsx の全行（無効な行も含む）。色は "#RRGGBB"、空欄は None のまま
+    # .json / .csv のルールファイルもそのまま読む
     from openpyxl import load_workbook
     import io
 
+    name = pref_file if isinstance(pref_file, str) else getattr(pref_file, "name", "")
+    kind = os.path.splitext(str(name))[1].lower().lstrip(".")
+    if kind in ("json", "csv"):
+        return _pref_text_rows(pref_file, kind)
+
     # ファイルパスかファイルオブジェクトかを判定
     if isinstance(pref_file, str):
         wb = load_workbook(filename=pref_file)
@@ -86,7 +194,7 @@ def load_pref_rules(pref_file):
 
     ws = wb.active
     data = list(ws.iter_rows(min_row=2, values_only=True))
-    rules = []
+    rows = []
     for i, row in enumerate(data):
         enable, first, op, second, label, _ = row[:6]
         cell = ws.cell(row=i + 2, column=6)
@@ -96,20 +204,79 @@ def load_pref_rules(pref_file):
             if fill and fill.start_color and fill.start_color.type == "rgb"
             else ""
         )
-        rgb_color = f"#{color[-6:]}" if color else ""
-        if str(enable).strip().upper() == "YES":
-            rules.append(
-                {
-                    "first": str(first).strip(),
-                    "second": str(second).strip(),
-                    "op": str(op).strip().upper(),
-                    "label": str(label).strip(),
-                    "color": rgb_color,
-                }
-            )
+        rows.append(
+            {
+                "enable": str(enable).strip().upper() == "YES",
+                "first": first,
+                "op": op,
+                "second": second,
+                "label": label,
+                "color": f"#{color[-6:]}" if color else "",
+            }
+        )
+    return rows
+
+
+def pref_rules_from_table(rows):
+    # 空欄は Excel から読んだときと同じく文字列 "None" になる
+    def text(v):
+        return str(None if v == "" else v).strip()
+
+    # 色は "#" の有無や大文字小文字を揃えて "#RRGGBB" にする
+    def color(v):
+        v = (v or "").strip().lstrip("#")
+        return f"#{v.upper()}" if v else ""
+
+    return [
+        {
+            "first": text(row["first"]),
+            "second": text(row["second"]),
+            "op": text(row["op"]).upper(),
+            "label": text(row["label"]),
+            "color": color(row["color"]),
+        }
+        for row in rows
+        if row["enable"]
+    ]
+
+
+def load_pref_rules(pref_file, cache_dir=None):
+    # ファイルの中身のハッシュをキーに、ルールにしたものをキャッシュする
+    # （PREF.xlsx を保存し直せばキーが変わるので、古いキャッシュは使われない）
+    cache_dir = cache_dir or CACHE_DIR
+    key = file_key(pref_file)
+    rules = load_cached(key, kind="pref", cache_dir=cache_dir)
+    if rules is None:
+        rules = pref_rules_from_table(load_pref_table(pref_file))
+        save_cached(key, rules, kind="pref", cache_dir=cache_dir)
     return rules
 
 
+def save_pref_table(rows, out):
+    # load_pref_table の行を PREF.xlsx と同じ並び（6列目の塗りが色）で書き出す
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "色分け設定"
+    ws.append(PREF_HEADER)
+    for row in rows:
+        ws.append(
+            [
+                "YES" if row["enable"] else "NO",
+                *(
+                    row[k] if row[k] not in ("", None) else None
+                    for k in ("first", "op", "second", "label")
+                ),
+                None,
+            ]
+        )
+        color = (row["color"] or "").replace("#", "")
+        if color:
+            ws.cell(row=ws.max_row, column=6).fill = PatternFill(
+                fill_type="solid", fgColor="FF" + color.upper()
+            )
+    wb.save(out)
+
+
 def match_rule_in_multiline(text, rule, debug_log_path="debug_log.txt"):
     lines = str(text).split("\n")
     cond1 = rule["first"].strip()
@@ -135,41 +302,141 @@ def match_rule_in_multiline(text, rule, debug_log_path="debug_log.txt"):
         return False
 
 
-def apply_pref_rules_to_cell(cell, val, rules, fallback_color=None):
-    text = str(val)
-    lines = text.split("\n")  # 改行で分割
-    for rule in rules:
-        first = rule["first"] or ""
-        second = rule["second"] or ""
-        op = rule["op"].upper()
-
-        cond1_found = any(
-            re.fullmatch(first, line) or re.search(first, line)
-            for line in lines
-            if first
-        )
-        cond2_found = any(
-            re.fullmatch(second, line) or re.search(second, line)
-            for line in lines
-            if second
+def pref_rule_index(val, rules):
+    # 最初に一致したルールの番号（一致なしは None）
+    # 固定文字列のパターンは Aho-Corasick でまとめて探し、残りだけ正規表現で調べる
+    return match_index(rule_matcher(rules), val)
+
+
+def pref_color(val, rules, fallback_color=None):
+    # 最初に一致したルールの色（"RRGGBB"）を返す。一致なしは fallback_color
+    k = pref_rule_index(val, rules)
+    return fallback_color if k is None else rules[k]["color"].replace("#", "")
+
+
+# ==== PREF → 条件付き書式 ====
+
+
+def _terms_formula(terms, ref):
+    # 改行で区切られた行のどれかに当たるかを FIND（大文字小文字を区別）で調べる
+    parts = []
+    for head, word, tail in terms:
+        needle = '"' + word.replace('"', '""') + '"'
+        hay = ref
+        if head:
+            needle, hay = f"CHAR(10)&{needle}", f"CHAR(10)&{hay}"
+        if tail:
+            needle, hay = f"{needle}&CHAR(10)", f"{hay}&CHAR(10)"
+        parts.append(f"ISNUMBER(FIND({needle},{hay}))")
+    if not parts:
+        return "FALSE"
+    return parts[0] if len(parts) == 1 else f"OR({','.join(parts)})"
+
+
+def pref_rule_formula(rule, ref):
+    # pref_color と同じ判定を ref（勤務のセル）に対する Excel の式にする。できなければ None
+    first = rule["first"] or ""
+    second = rule["second"] or ""
+    t1, t2 = pattern_terms(first), pattern_terms(second)
+    if t1 is None or t2 is None:
+        return None
+    c1, c2 = _terms_formula(t1, ref), _terms_formula(t2, ref)
+    op = rule["op"].upper()
+    if op == "AND":
+        return f"AND({c1},{c2})"
+    if op == "OR":
+        return f"OR({c1},{c2})"
+    if op == "NONE":
+        return "TRUE" if first == "" and second == "" else f"OR({c1},{c2})"
+    return "FALSE"
+
+
+def row_ranges(cells):
+    # (行, 列) の集まり → "A2:AE2 C7:AE7" のような複数範囲
+    areas = []
+    for r, c in sorted(cells):
+        if areas and areas[-1][0] == r and areas[-1][2] == c - 1:
+            areas[-1][2] = c
+        else:
+            areas.append([r, c, c])
+    return " ".join(
+        f"{get_column_letter(a)}{r}:{get_column_letter(b)}{r}" for r, a, b in areas
+    )
+
+
+def add_pref_conditional_formats(ws, pref_rules, cells):
+    # cells（日付行のセル）に、勤務のセル（1行下）を見る条件付き書式を優先順に付ける
+    if not cells:
+        return
+    sqref = row_ranges(cells)
+    # 範囲の文字列は長いので1回だけ解釈し、全部のルールで同じ範囲を使う
+    target = ConditionalFormatting(sqref)
+    first = sqref.split(":")[0]
+    m = re.fullmatch(r"([A-Z]+)([0-9]+)", first)
+    ref = f"{m.group(1)}{int(m.group(2)) + 1}"
+    for rule in pref_rules:
+        formula = pref_rule_formula(rule, ref)
+        color = rule["color"].replace("#", "")
+        if formula is None or not color:
+            continue
+        ws.conditional_formatting.add(
+            target,
+            FormulaRule(
+                formula=[formula],
+                stopIfTrue=True,
+                fill=PatternFill(start_color=color, end_color=color, fill_type="solid"),
+            ),
         )
 
-        match = (
-            (op == "AND" and cond1_found and cond2_found)
-            or (op == "OR" and (cond1_found or cond2_found))
-            or (
-                op == "NONE"
-                and (cond1_found or cond2_found or (first == "" and second == ""))
-            )
+
+def apply_pref_rules_to_cell(cell, val, rules, fallback_color=None):
+    color = pref_color(val, rules, fallback_color)
+    if color:
+        cell.fill = PatternFill(fill_type="solid", fgColor=color)
+
+
+def build_named_styles(wb, pref_rules, fallback_color="DDDDDD"):
+    # セルごとにスタイルを作らず、組み合わせごとに名前付きスタイルを1回だけ登録する
+    # 戻り値: 種類 → スタイル名（日付行は ("date", 色)、色なしは ("date", "")）
+    double = Side(border_style="double", color="000000")
+    top_left = Alignment(horizontal="left", vertical="top", wrap_text=True)
+    date = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    styles = {
+        "header": NamedStyle(
+            "sk-header", alignment=top_left, border=Border(top=double, bottom=double)
+        ),
+        "header_nowrap": NamedStyle(
+            "sk-header-nowrap",
+            alignment=Alignment(horizontal="left", vertical="top", wrap_text=False),
+            border=Border(top=double, bottom=double),
+        ),
+        "wrap": NamedStyle("sk-schedule-wrap", alignment=top_left),
+        "highlight": NamedStyle(
+            "sk-onboard-highlight",
+            alignment=top_left,
+            fill=PatternFill(fill_type="solid", fgColor="FFEE99"),
+        ),
+        ("date", ""): NamedStyle("sk-date", alignment=date),
+    }
+    colors = [fallback_color] + [rule["color"].replace("#", "") for rule in pref_rules]
+    for c in dict.fromkeys(c for c in colors if c):
+        styles[("date", c)] = NamedStyle(
+            f"sk-date-{c}",
+            alignment=date,
+            fill=PatternFill(fill_type="solid", fgColor=c),
         )
+    for style in styles.values():
+        style.font = DEFAULT_FONT  # 既定の NamedStyle は空のフォントになる
+        wb.add_named_style(style)
+    return {key: style.name for key, style in styles.items()}
 
-        if match:
-            cell.fill = PatternFill(
-                fill_type="solid", fgColor=rule["color"].replace("#", "")
-            )
-            return
-    if fallback_color:
-        cell.fill = PatternFill(fill_type="solid", fgColor=fallback_color)
+
+# 同乗者の出し方: rows は1人1行、compact は1日1セルに改行でまとめる、
+# count は人数だけにして便別乗員のシートへリンクする
+ONBOARD_LAYOUTS = ("rows", "compact", "count")
+# 1セルにまとめたときの同じ所属の乗員名（文字単位では塗れないので太字・色にする）
+HIGHLIGHT_TEXT = "9C5700"
+MANIFEST_SHEET = "便別乗員"
 
 
 def write_onboard_rows(
@@ -181,41 +448,152 @@ def write_onboard_rows(
     block_aff,
     self_name,
     name_to_row,
+    external=None,
+    styles=None,
+    native_links=False,
+    layout="rows",
+    day_links=None,
 ):
+    # external: 別ファイル（シャード）にいる乗員の 氏名 → (ファイル名, 行, 社員番号)
+    # native_links: HYPERLINK 式ではなくセルのハイパーリンクにする（開くときに再計算しない）
+    # day_links: count のとき日ごとの便別乗員シートの行（manifest_links）
+    external = external or {}
+
+    def same_base(name):
+        emp = name_to_emp.get(name) or external.get(name, (0, 0, ""))[2]
+        return bool(emp) and emp_aff_map.get(emp) == block_aff
+
+    def set_style(cell, style):
+        if styles:
+            cell.style = styles[style]
+        else:
+            cell.alignment = Alignment(
+                horizontal="left", vertical="top", wrap_text=True
+            )
+            if style == "highlight":
+                cell.fill = PatternFill(fill_type="solid", fgColor="FFEE99")
+
+    if layout != "rows":
+        bold = InlineFont(b=True, color=HIGHLIGHT_TEXT)
+        for j, names in enumerate(onboard_data, start=1):
+            names = [n for n in names if n and n != self_name]
+            cell = ws.cell(row=start_row, column=j)
+            style = "wrap"
+            if layout == "compact":
+                if any(same_base(n) for n in names):
+                    parts = []
+                    for k, name in enumerate(names):
+                        if k:
+                            parts.append("\n")
+                        parts.append(TextBlock(bold, name) if same_base(name) else name)
+                    cell.value = CellRichText(parts)
+                else:
+                    cell.value = "\n".join(names)
+            else:
+                row = day_links[j - 1] if day_links and j - 1 < len(day_links) else None
+                if any(same_base(n) for n in names):
+                    style = "highlight"
+                if names and row and native_links:
+                    cell.value = len(names)
+                    cell.hyperlink = Hyperlink(
+                        ref=cell.coordinate, location=f"'{MANIFEST_SHEET}'!A{row}"
+                    )
+                elif names and row:
+                    cell.value = (
+                        f"=HYPERLINK(\"#'{MANIFEST_SHEET}'!A{row}\", {len(names)})"
+                    )
+                else:
+                    cell.value = len(names) or ""
+            set_style(cell, style)
+        return 1
+
     max_onb = max((len(day) for day in onboard_data if day), default=1)
     for i in range(max_onb):
+        # 隣の日と同じ人へのリンクは1つの範囲（C4:E4 など）にまとめる
+        run = None
         for j, names in enumerate(onboard_data, start=1):
             value = names[i] if i < len(names) else ""
             if value == self_name:
                 value = ""
             target_row = name_to_row.get(value)
             cell = ws.cell(row=start_row + i, column=j)
-            if value and target_row:
+            if native_links and value and (target_row or value in external):
+                cell.value = value
+                if target_row:
+                    link = (None, f"{ws.title}!A{target_row}")
+                else:
+                    path, row, _ = external[value]
+                    link = (path, f"Sheet!A{row}")
+                if run and run[1] == link and run[2] == j - 1:
+                    run[0].ref = f"{run[0].ref.split(':')[0]}:{cell.coordinate}"
+                    run[2] = j
+                else:
+                    cell.hyperlink = Hyperlink(
+                        ref=cell.coordinate, target=link[0], location=link[1]
+                    )
+                    run = [cell.hyperlink, link, j]
+            elif value and target_row:
                 cell.value = f'=HYPERLINK("#A{target_row}", "{value}")'
+            elif value in external:
+                path, row, _ = external[value]
+                cell.value = f'=HYPERLINK("{path}#Sheet!A{row}", "{value}")'
             else:
                 cell.value = value
-            cell.alignment = Alignment(
-                horizontal="left", vertical="top", wrap_text=True
-            )
-            if value:
-                emp = name_to_emp.get(value)
-                if emp and emp_aff_map.get(emp) == block_aff:
-                    cell.fill = PatternFill(fill_type="solid", fgColor="FFEE99")
+            set_style(cell, "highlight" if value and same_base(value) else "wrap")
     return max_onb
 
 
-def write_to_excel(records, emp_aff_map, out_xlsx, pref_rules):
-    from openpyxl import Workbook
+def write_table_sheet(wb, title, rows):
+    ws = wb.create_sheet(title)
+    for row in rows:
+        ws.append(row)
+    ws.freeze_panes = "A2"
+    return ws
 
-    wb = Workbook()
-    ws = wb.active
 
-    name_to_emp = {rec["hdr"][0]: rec["emp_no"] for rec in records}
+def block_rows(records, layout="rows"):
+    # 氏名 → リンク先の行（write_to_excel と同じ行の数え方）
     name_to_row = {}
     row_counter = 1
     for rec in records:
-        row_counter += 3 + max((len(x) for x in rec.get("onb", [])), default=1)
+        if layout == "rows":
+            row_counter += 3 + max((len(x) for x in rec.get("onb", [])), default=1)
+        else:
+            row_counter += 4
         name_to_row[rec["hdr"][0]] = row_counter
+    return name_to_row
+
+
+def write_to_excel(
+    records,
+    emp_aff_map,
+    out_xlsx,
+    pref_rules,
+    sheets=(),
+    external=None,
+    profile="full",
+    onboard_layout="rows",
+    manifest_at=None,
+):
+    # profile="lite": 色は条件付き書式（式にできないルールだけ固定の塗り）、
+    # 同乗者のリンクはセルのハイパーリンクにする。勤務を書き換えても色が追従するためのもので、
+    # ファイルは full より少し大きく（7月分で約 2%）、書き出しの時間はほぼ同じ
+    # manifest_at: onboard_layout="count" のリンク先（manifest_positions）
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+
+    name_to_emp = {rec["hdr"][0]: rec["emp_no"] for rec in records}
+    name_to_row = block_rows(records, onboard_layout)
+    styles = build_named_styles(wb, pref_rules)
+    date_style = {}
+    lite = profile == "lite"
+    formulas = [
+        lite and pref_rule_formula(rule, "A1") is not None for rule in pref_rules
+    ]
+    cf_rules = [rule for rule, ok in zip(pref_rules, formulas) if ok]
+    cf_cells = []
 
     row_num = 1
     for rec in records:
@@ -225,29 +603,34 @@ def write_to_excel(records, emp_aff_map, out_xlsx, pref_rules):
         for j, val in enumerate(rec["hdr"], start=1):
             cell = ws.cell(row=row_num, column=j, value=val)
             wrap = not bool(re.fullmatch(r"0[0-9]{1,}-[0-9]+-[0-9]{4}", val))
-            cell.alignment = Alignment(
-                horizontal="left", vertical="top", wrap_text=wrap
-            )
-            cell.border = Border(
-                top=Side(border_style="double", color="000000"),
-                bottom=Side(border_style="double", color="000000"),
-            )
+            cell.style = styles["header" if wrap else "header_nowrap"]
 
         for j, date_val in enumerate(rec["dr"], start=1):
             sched_val = rec["sched"][j - 1] if j - 1 < len(rec["sched"]) else ""
             cell = ws.cell(row=row_num + 1, column=j, value=date_val)
-            cell.alignment = Alignment(
-                horizontal="center", vertical="center", wrap_text=True
-            )
-            apply_pref_rules_to_cell(
-                cell, sched_val, pref_rules, fallback_color="DDDDDD"
-            )
+            # 同じ勤務の文字列は何度も出てくるので色の判定結果を使い回す
+            if sched_val not in date_style:
+                k = pref_rule_index(sched_val, pref_rules)
+                color = (
+                    "DDDDDD" if k is None else pref_rules[k]["color"].replace("#", "")
+                )
+                # lite では式にできるルール（と一致なし）は条件付き書式に任せる。
+                # 式にできないルールが先に当たるセルは固定の塗りにし、
+                # 後ろの式が誤って当たる場合だけ条件付き書式の範囲から外す
+                dynamic = lite and (k is None or formulas[k])
+                if dynamic:
+                    color = "DDDDDD"
+                covered = lite and (
+                    dynamic or pref_rule_index(sched_val, cf_rules) is None
+                )
+                date_style[sched_val] = (styles[("date", color or "")], covered)
+            cell.style, covered = date_style[sched_val]
+            if covered:
+                cf_cells.append((row_num + 1, j))
 
         for j, val in enumerate(rec["sched"], start=1):
             cell = ws.cell(row=row_num + 2, column=j, value=val)
-            cell.alignment = Alignment(
-                horizontal="left", vertical="top", wrap_text=True
-            )
+            cell.style = styles["wrap"]
 
         onboard_count = write_onboard_rows(
             ws,
@@ -258,32 +641,254 @@ def write_to_excel(records, emp_aff_map, out_xlsx, pref_rules):
             block_aff,
             self_name,
             name_to_row,
+            external,
+            styles,
+            lite,
+            onboard_layout,
+            manifest_links(rec, manifest_at) if manifest_at else None,
         )
         row_num += 3 + onboard_count
 
+    add_pref_conditional_formats(ws, pref_rules, cf_cells)
+    for title, rows in sheets:
+        write_table_sheet(wb, title, rows)
     wb.save(out_xlsx)
 
 
+# ==== Sharded output ====
+
+
+def shard_records(records, by="base"):
+    # 所属の頭3文字ごと、または by 人ずつに分ける（並び順はそのまま）
+    shards = {}
+    for i, rec in enumerate(records):
+        if by == "base":
+            name = crew_base(rec) or "その他"
+        else:
+            name = f"{i // int(by) + 1:03d}"
+        shards.setdefault(name, []).append(rec)
+    return shards
+
+
+def _write_shard(args):
+    records, emp_aff_map, path, pref_rules, external, profile, layout = args
+    write_to_excel(
+        records,
+        emp_aff_map,
+        path,
+        pref_rules,
+        external=external,
+        profile=profile,
+        onboard_layout=layout,
+    )
+    return path
+
+
+SHARD_INDEX = "shard_files.json"
+
+
+def write_shards(
+    records,
+    emp_aff_map,
+    pref_rules,
+    out_dir="shards",
+    by="base",
+    workers=None,
+    profile="full",
+    onboard_layout="rows",
+):
+    # シャードごとに別プロセスで書く。他のシャードの乗員へのリンクはファイルをまたいで張る
+    # 便別乗員のシートはシャードに入れないので count の人数にはリンクを付けない
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(out_dir, exist_ok=True)
+    # 前回の分け方のファイルが混ざらないように、前回書いたファイル（一覧に残したもの）だけ消す
+    index = os.path.join(out_dir, SHARD_INDEX)
+    if os.path.exists(index):
+        with open(index, encoding="utf-8") as f:
+            for name in json.load(f):
+                old = os.path.join(out_dir, os.path.basename(name))
+                if os.path.exists(old):
+                    os.remove(old)
+    shards = shard_records(records, by)
+    files = {
+        name: "formatted_schedule_" + re.sub(r'[\\/:*?"<>|\s]', "_", name) + ".xlsx"
+        for name in shards
+    }
+    targets = {}
+    for name, recs in shards.items():
+        for person, row in block_rows(recs, onboard_layout).items():
+            targets.setdefault(person, (files[name], row))
+    emp_of = {rec["hdr"][0]: rec["emp_no"] for rec in records}
+    jobs = []
+    for name, recs in shards.items():
+        inside = {rec["hdr"][0] for rec in recs}
+        external = {
+            person: (path, row, emp_of[person])
+            for person, (path, row) in targets.items()
+            if person not in inside
+        }
+        path = os.path.join(out_dir, files[name])
+        jobs.append(
+            (recs, emp_aff_map, path, pref_rules, external, profile, onboard_layout)
+        )
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        written = list(pool.map(_write_shard, jobs))
+    with open(index, "w", encoding="utf-8") as f:
+        json.dump(sorted(files.values()), f, ensure_ascii=False)
+    return written
+
+
 # その他 main 関数などは既存通り（適宜 pref_rules を渡すようにする）
 
 
-def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
-    sched = pd.read_csv(schedule_file, header=None, dtype=str).fillna("")
+# ==== Cache ====
+
+CACHE_DIR = ".schedule_cache"
+STORE_DIR = "schedule_store"
+CACHE_VERSION = 12
+
+
+def _file_bytes(f):
+    if isinstance(f, (str, os.PathLike)):
+        with open(f, "rb") as fh:
+            return fh.read()
+    f.seek(0)
+    data = f.read()
+    f.seek(0)
+    return data
+
+
+def file_key(*files):
+    h = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for f in files:
+        h.update(_file_bytes(f))
+    return h.hexdigest()[:16]
+
+
+def load_cached(key, kind="roster", cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, f"{kind}_{key}.pkl")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        # 壊れたキャッシュは作り直す
+        return None
+
+
+def save_cached(key, obj, kind="roster", cache_dir=CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{kind}_{key}.pkl")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return path
+
+
+def _file_name(f):
+    return os.path.basename(f) if isinstance(f, (str, os.PathLike)) else f.name
+
+
+def load_roster(schedule_file, emp_file, cache_dir=CACHE_DIR):
+    # スケジュールCSV・職員番号CSVの内容が同じなら解析結果をキャッシュから返す
+    # schedule_file にリストを渡すと各ファイルを（キャッシュ経由で）読んでまとめる
+    files = (
+        list(schedule_file)
+        if isinstance(schedule_file, (list, tuple))
+        else [schedule_file]
+    )
+    key = file_key(*files, emp_file)
+    roster = load_cached(key, cache_dir=cache_dir)
+    fresh = roster is None
+    if fresh:
+        if len(files) == 1:
+            roster = parse_roster(files[0], emp_file)
+        else:
+            roster = merge_rosters(
+                [load_roster(f, emp_file, cache_dir) for f in files],
+                [_file_name(f) for f in files],
+            )
+        roster["key"] = key
+        save_cached(key, roster, cache_dir=cache_dir)
+    month = roster.get("month")
+    in_month = all(d[:4] + d[5:7] == month for d in roster["dates"] if d)
+    if month and (len(files) == 1 or in_month):
+        # 年月からも引けるようにしておく（翌月の実行で前月として使う）
+        # 複数の月をまとめたものはその月の代わりにしない
+        # 指し先にはキャッシュの版も持たせ、古い版の指し先は読み込み時に張り直す
+        if fresh or month_key(month, cache_dir) is None:
+            save_cached(month, (CACHE_VERSION, key), kind="month", cache_dir=cache_dir)
+    return roster
+
+
+def month_key(month, cache_dir=CACHE_DIR):
+    # 年月 → 今の版のキャッシュのキー（古い版・壊れた指し先は None）
+    pointer = load_cached(month, kind="month", cache_dir=cache_dir)
+    if isinstance(pointer, tuple) and pointer[0] == CACHE_VERSION:
+        return pointer[1]
+    return None
+
+
+def cached_months(cache_dir=CACHE_DIR):
+    if not os.path.isdir(cache_dir):
+        return []
+    months = (
+        f[len("month_") : -len(".pkl")]
+        for f in os.listdir(cache_dir)
+        if f.startswith("month_") and f.endswith(".pkl")
+    )
+    return sorted(m for m in months if month_key(m, cache_dir))
+
+
+def load_prev_roster(prev, emp_file, cache_dir=CACHE_DIR):
+    # prev は前月のスケジュールCSV、またはキャッシュ済みの年月（例: 202506）
+    if isinstance(prev, str) and re.fullmatch(r"[0-9]{6}", prev):
+        key = month_key(prev, cache_dir)
+        return load_cached(key, cache_dir=cache_dir) if key else None
+    return load_roster(prev, emp_file, cache_dir=cache_dir)
+
+
+# ==== Pipeline ====
+
+HDR_WIDTH = 31
+MONTH_WIDTH = 31
+
+
+def read_schedule_csv(schedule_file):
+    # 期間の長いエクスポートは行ごとに列数が違うので、最大の列数にそろえて読む
+    text = _file_bytes(schedule_file).decode("utf-8-sig")
+    rows = [r for r in csv.reader(io.StringIO(text)) if r]
+    width = max((len(r) for r in rows), default=0)
+    return pd.DataFrame([r + [""] * (width - len(r)) for r in rows], dtype=str)
+
+
+def parse_roster(schedule_file, emp_file):
+    sched = read_schedule_csv(schedule_file)
     emp_df = pd.read_csv(emp_file, header=None, dtype=str).fillna("")
-    pref_rules = load_pref_rules(pref_file)
     emp_name_map = {row[2]: row[4] for _, row in emp_df.iterrows()}
     emp_two_map = {row[2]: row[6] for _, row in emp_df.iterrows()}
     emp_aff_map = {row[2]: row[0] for _, row in emp_df.iterrows()}
     emp_col8_map = {row[2]: row[7] for _, row in emp_df.iterrows()}
     emp_order = emp_df.iloc[:, 2].tolist()
+    # タイトル行の対象年月（例: 202507）
+    month = next(
+        (v.strip() for v in sched.iloc[0] if re.fullmatch(r"[0-9]{6}", v.strip())),
+        "",
+    )
     df = sched.copy().map(clean_cell).pipe(remove_blank_and_ob)
     blocks = slice_blocks(df)
     if not blocks:
-        return
+        return {"records": [], "emp_aff_map": emp_aff_map, "month": month}
     global_dates = blocks[0][3]
+    # 月次は従来どおり 31 列、それより長い期間は日数分の列にする
+    width = max(len(global_dates), MONTH_WIDTH)
     records = []
     for h, d, end, dates in blocks:
         raw = [clean_cell(x) for x in df.iloc[h]]
+        roman = raw[0]
         matched = [v for v in raw if re.fullmatch(r"000[0-9]{5}", v)]
         code = matched[0][3:] if matched else ""
         surname = emp_name_map.get(code, clean_cell(df.iat[h, 0]))
@@ -291,12 +896,12 @@ def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
         rec_aff = emp_aff_map.get(code, "")
         raw[0] = f"{surname}{two}" if matched else raw[0]
         vals = [v for v in raw if v]
-        hdr = vals[:31] + [""] * (31 - len(vals[:31]))
+        hdr = vals[:HDR_WIDTH] + [""] * (HDR_WIDTH - len(vals[:HDR_WIDTH]))
         col8 = emp_col8_map.get(code, "")
         m = re.search(r"(\d+.+)", col8)
         if m:
-            hdr[29] = f"PH{m.group(1)}"
-        hdr[30] = rec_aff
+            hdr[HDR_WIDTH - 2] = f"PH{m.group(1)}"
+        hdr[HDR_WIDTH - 1] = rec_aff
         hdr = [
             re.sub(
                 r"電話番号",
@@ -309,7 +914,7 @@ def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
             )
             for v in hdr
         ]
-        dr = [clean_cell(df.iat[d, j]) for j in dates] + [""] * (31 - len(dates))
+        dr = [clean_cell(df.iat[d, j]) for j in dates] + [""] * (width - len(dates))
         fe = []
         for j in dates:
             fe.append(
@@ -319,7 +924,7 @@ def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
                     if clean_cell(df.iat[r2, j])
                 ]
             )
-        sched_row = ["\n".join(e) for e in fe] + [""] * (31 - len(fe))
+        sched_row = ["\n".join(e) for e in fe] + [""] * (width - len(fe))
         records.append(
             {
                 "emp_no": code,
@@ -328,26 +933,22 @@ def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
                 "sched": sched_row,
                 "full_entries": fe,
                 "aff": rec_aff,
+                "roman": roman,
+                "surname": surname,
+                "two": two,
+                "rank": header_value(hdr, "ランク："),
             }
         )
     for rec in records:
         if len(rec["full_entries"]) < len(global_dates):
             rec["full_entries"] += [[]] * (len(global_dates) - len(rec["full_entries"]))
-    for i, rec in enumerate(records):
-        onb = []
-        for idx, entries in enumerate(rec["full_entries"]):
-            flights = [e for e in entries if e and re.match(r"^[0-9]", e)]
-            names = []
-            for j, other in enumerate(records):
-                if i == j:
-                    continue
-                if any(f in other["full_entries"][idx] for f in flights):
-                    names.append(other["hdr"][0])
-            uniq = []
-            for n in names:
-                if n not in uniq:
-                    uniq.append(n)
-            onb.append(uniq)
+    return finish_roster(records, emp_aff_map, emp_order, month)
+
+
+def finish_roster(records, emp_aff_map, emp_order, month):
+    flight_index = build_flight_index(records)
+    onboard = [onboard_names(records, flight_index, i) for i in range(len(records))]
+    for rec, onb in zip(records, onboard):
         rec["onb"] = onb
     seen = set()
     uniq = []
@@ -362,6 +963,166 @@ def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
             emp_order.index(r["emp_no"]) if r["emp_no"] in emp_order else float("inf")
         )
     )
+    dates = day_dates(month, records[0]["dr"])
+    return {
+        "records": records,
+        "emp_aff_map": emp_aff_map,
+        "month": month,
+        "dates": dates,
+        "search": build_search_index(records, dates),
+        "flights": build_flight_index(records),
+        "avail": build_availability(records),
+        "quals": build_qual_index(records),
+        "emp_order": emp_order,
+    }
+
+
+def merge_rosters(rosters, names=None):
+    # 複数のエクスポート（機種・チーム別など）を社員番号でまとめ、日付で列をそろえる
+    # 同じ人の同じ日に別々の内容があれば先のファイルを優先し、衝突として記録する
+    names = names or [str(k) for k in range(len(rosters))]
+    dates = sorted({d for r in rosters for d in r.get("dates", []) if d})
+    col = {d: k for k, d in enumerate(dates)}
+    merged = {}
+    conflicts = []
+    for name, roster in zip(names, rosters):
+        for rec in roster["records"]:
+            entries = [[] for _ in dates]
+            for d, e in zip(roster["dates"], rec["full_entries"]):
+                if d:
+                    entries[col[d]] = list(e)
+            key = rec["emp_no"] or (name, rec["hdr"][0])
+            base = merged.get(key)
+            if base is None:
+                merged[key] = dict(rec, full_entries=entries, src=[name])
+                continue
+            base["src"].append(name)
+            for k, (a, b) in enumerate(zip(base["full_entries"], entries)):
+                if not b or a == b:
+                    continue
+                if a:
+                    conflicts.append(
+                        [
+                            dates[k],
+                            rec["emp_no"],
+                            base["hdr"][0],
+                            " / ".join(base["src"][:-1]),
+                            " ".join(a),
+                            name,
+                            " ".join(b),
+                        ]
+                    )
+                else:
+                    base["full_entries"][k] = b
+    width = max(len(dates), MONTH_WIDTH)
+    labels = [d[8:] for d in dates] + [""] * (width - len(dates))
+    records = []
+    for rec in merged.values():
+        sched_row = ["\n".join(e) for e in rec["full_entries"]]
+        records.append(
+            dict(rec, dr=labels, sched=sched_row + [""] * (width - len(sched_row)))
+        )
+    month = dates[0][:4] + dates[0][5:7] if dates else ""
+    emp_order = list(dict.fromkeys(e for r in rosters for e in r.get("emp_order", [])))
+    roster = finish_roster(records, rosters[0]["emp_aff_map"], emp_order, month)
+    roster["conflicts"] = conflicts
+    return roster
+
+
+MERGE_CONFLICT_HEADER = [
+    "日付",
+    "職番",
+    "氏名",
+    "ファイル",
+    "内容",
+    "別ファイル",
+    "別の内容",
+]
+
+
+MANIFEST_CSV = "flight_manifest.csv"
+QUAL_CSV = "qualification_expiry.csv"
+STAFFING_CSV = "staffing.csv"
+MERGE_CSV = "merge_conflicts.csv"
+VIOLATIONS_CSV = "violations.csv"
+COMPLEMENT_CSV = "complement_exceptions.csv"
+RULE_STATS_CSV = "rule_stats.csv"
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(rows)
+
+
+def update_pairing_store(roster, store_dir=STORE_DIR):
+    # 月をまたいで同乗回数を貯めていく（日付の年月ごとに置き換え）
+    pairing = build_pairing(roster["records"], roster["flights"], roster["dates"])
+    store = merge_pairing(
+        load_cached("pairing", kind="store", cache_dir=store_dir), pairing
+    )
+    save_cached("pairing", store, kind="store", cache_dir=store_dir)
+    return store
+
+
+def update_totals_store(roster, store_dir=STORE_DIR):
+    # 月ごとの件数（乗員 × 列）を貯めていく。追加する月の分だけ集計する
+    totals = month_totals(
+        roster["records"], roster["avail"], roster["flights"], roster["dates"]
+    )
+    store = merge_totals(
+        load_cached("totals", kind="store", cache_dir=store_dir), totals
+    )
+    save_cached("totals", store, kind="store", cache_dir=store_dir)
+    return store
+
+
+def run(
+    schedule_file,
+    emp_file,
+    pref_file="PREF.xlsx",
+    onboard="day",
+    trip_gap=1,
+    prev=None,
+    context_days=7,
+    legality_file=None,
+    shard=None,
+    shard_dir="shards",
+    workers=None,
+    engine="openpyxl",
+    profile="full",
+    reorder=False,
+    onboard_layout="rows",
+):
+    if reorder and profile == "lite":
+        raise ValueError(
+            "ルールの並べ替えは lite では使えません（条件付き書式の順になるため）"
+        )
+    roster = load_roster(schedule_file, emp_file)
+    records = roster["records"]
+    if not records:
+        return
+    pref_rules = load_pref_rules(pref_file or "PREF.xlsx")
+    emp_aff_map = roster["emp_aff_map"]
+    prev_roster = load_prev_roster(prev, emp_file) if prev else None
+    if prev and prev_roster is None:
+        raise ValueError(f"前月のデータが見つかりません: {prev}")
+    timeline = timeline_roster(roster, prev_roster, context_days)
+    if prev and context_days and not timeline["offset"]:
+        raise ValueError(f"前月のデータに当月より前の日付がありません: {prev}")
+    if onboard == "trip":
+        # 同乗者を日ごとではなくトリップ（連続した乗務）単位で出す
+        # 前月末から続くトリップも前月分をつないだタイムラインで判定する
+        trips = build_trips(timeline["records"], trip_gap)
+        off = timeline["offset"]
+        records = [
+            dict(
+                rec,
+                onb=trip_onboard_names(
+                    timeline["records"], timeline["flights"], trips, i
+                )[off:],
+            )
+            for i, rec in enumerate(records)
+        ]
     out_csv = "formatted_schedule.csv"
     with open(out_csv, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
@@ -370,17 +1131,346 @@ def run(schedule_file, emp_file, pref_file="PREF.xlsx"):
             w.writerow(rec["dr"])
             w.writerow(rec["sched"])
             w.writerow(["\n".join(x) for x in rec["onb"]])
+    manifest = [MANIFEST_HEADER] + manifest_rows(
+        records, roster["flights"], roster["dates"]
+    )
+    write_csv(MANIFEST_CSV, manifest)
+    if "conflicts" in roster:
+        write_csv(MERGE_CSV, [MERGE_CONFLICT_HEADER] + roster["conflicts"])
+    write_csv(QUAL_CSV, [QUAL_HEADER] + qual_rows(roster["quals"], records))
+    staffing = build_staffing(records, roster["avail"], len(records[0]["dr"]))
+    staffing = [staffing_header(staffing)] + staffing_rows(staffing, roster["dates"])
+    write_csv(STAFFING_CSV, staffing)
+    # 前月分をつないだタイムラインで判定し、当月分の違反だけを出す
+    legality = load_legality_rules(legality_file)
+    violations = [VIOLATION_HEADER] + check_legality(
+        timeline["records"], legality, timeline["dates"], timeline["offset"]
+    )
+    write_csv(VIOLATIONS_CSV, violations)
+    complement = [complement_header(legality)] + check_complement(
+        records, roster["flights"], roster["dates"], legality
+    )
+    write_csv(COMPLEMENT_CSV, complement)
+    # ルールごとの当たり・評価の回数（使われていない・隠れているルールも出す）
+    texts = cell_texts(records)
+    stats = rule_stats(pref_rules, texts)
+    write_csv(RULE_STATS_CSV, [RULE_STATS_HEADER] + rule_stats_rows(pref_rules, stats))
+    if reorder:
+        pref_rules = reorder_rules(pref_rules, stats)
+        print(
+            f"PREF ルールの評価: {sum(stats['evals'])} → "
+            f"{total_evals(pref_rules, texts)} セル"
+        )
+    update_pairing_store(roster)
+    update_totals_store(roster)
+    if shard:
+        # シャード出力では表の各シートは CSV だけにする
+        write_shards(
+            records,
+            emp_aff_map,
+            pref_rules,
+            shard_dir,
+            shard,
+            workers,
+            profile,
+            onboard_layout,
+        )
+        return out_csv, shard_dir
     out_xlsx = "formatted_schedule20.xlsx"
-    write_to_excel(records, emp_aff_map, out_xlsx, pref_rules)
+    manifest_at = (
+        manifest_positions(roster["flights"]) if onboard_layout == "count" else None
+    )
+    sheets = [
+        (MANIFEST_SHEET, manifest),
+        ("日別人数", staffing),
+        ("違反", violations),
+        ("編成", complement),
+    ]
+    if engine == "parallel":
+        # 行範囲ごとにシート XML を別プロセスで作って1つのブックにまとめる
+        from schedule_xlsx import write_workbook_parallel
+
+        write_workbook_parallel(
+            records,
+            emp_aff_map,
+            out_xlsx,
+            pref_rules,
+            sheets,
+            workers,
+            onboard_layout=onboard_layout,
+            manifest_at=manifest_at,
+        )
+    else:
+        write_to_excel(
+            records,
+            emp_aff_map,
+            out_xlsx,
+            pref_rules,
+            sheets=sheets,
+            profile=profile,
+            onboard_layout=onboard_layout,
+            manifest_at=manifest_at,
+        )
     return out_csv, out_xlsx
 
 
-if __name__ == "__main__":
+def print_query(roster, text, day=None, limit=50):
+    records = roster["records"]
+    hits = search(roster["search"], text, day=day, limit=limit)
+    days = [
+        date or label
+        for label, date in zip(roster["search"]["days"], roster["search"]["dates"])
+    ]
+    for key, field, i in hits["crew"]:
+        rec = records[i]
+        print(f"{rec['emp_no']}\t{rec['hdr'][0]}\t{rec['roman']}\t{rec['aff']}")
+        for label, entries in zip(days, rec["full_entries"]):
+            if label:
+                print(f"  {label}\t{' '.join(entries)}")
+    for tok, d, i in hits["flights"]:
+        rec = records[i]
+        print(f"{days[d]}\t{tok}\t{rec['emp_no']}\t{rec['hdr'][0]}\t{rec['aff']}")
+    if not hits["crew"] and not hits["flights"]:
+        print("該当なし")
+
+
+def print_pairs(
+    store, emp=None, top=10, threshold=None, start=None, end=None, weight="flights"
+):
+    if store is None:
+        print("同乗データがありません（先に通常実行してください）")
+        return
+    if emp and (start or end):
+        hits = partners_between(store, emp, start or "0000-00-00", end or "9999-99-99")
+        for partner, flights in sorted(hits.items(), key=lambda kv: -len(kv[1])):
+            legs = " ".join(f"{d[5:]}:{tok}" for d, tok in flights)
+            print(f"{partner}\t{len(flights)}\t{legs}")
+    elif emp:
+        for partner, (n, nd) in top_partners(store, emp, top, weight):
+            print(f"{partner}\t{n}便\t{nd}日")
+    else:
+        for (a, b), (n, nd) in pairs_above(store, threshold or 1, weight)[:top]:
+            print(f"{a}\t{b}\t{n}便\t{nd}日")
+    print(f"# 対象月: {', '.join(sorted(store['months']))}")
+
+
+def print_totals(store, end=None, windows=(3, 6, 12), emp=None, code=None):
+    if not store or not store["months"]:
+        print("月別集計がありません（先に通常実行してください）")
+        return
+    end = end or max(store["months"])
+    columns = ["H", "TRN", "FLY"] + ([f"便:{code}"] if code else [])
+    print("\t".join(["職番"] + [f"{c}/{n}か月" for n in windows for c in columns]))
+    sums = [rolling_totals(store, end, n) for n in windows]
+    for e in [emp] if emp else sums[-1]["emps"]:
+        cells = [e]
+        for t in sums:
+            r = t["emps"].index(e) if e in t["emps"] else None
+            for c in columns:
+                ok = r is not None and c in t["columns"]
+                cells.append(str(t["counts"][r, t["columns"].index(c)] if ok else 0))
+        print("\t".join(cells))
+    print(f"# {end} まで / 対象月: {', '.join(sums[-1]['months'])}")
+
+
+def print_availability(roster, day, to=None, classes=("H",), rank=None, base=None):
+    records = roster["records"]
+    days = roster["search"]["days"]
+    dates = roster["dates"]
+    first = day_index(days, day, dates)
+    last = day_index(days, to, dates) if to else first
+    if first is None or last is None:
+        print(f"日付が見つかりません: {day} {to or ''}")
+        return
+    span = range(first, last + 1)
+    mask = availability_mask(roster["avail"], classes, span, rank, base)
+    for i in mask_members(mask):
+        rec = records[i]
+        duties = " / ".join(" ".join(rec["full_entries"][d]) or "-" for d in span)
+        print(
+            f"{rec['emp_no']}\t{rec['hdr'][0]}\t{rec['rank']}\t{crew_base(rec)}"
+            f"\t{duties}"
+        )
+    print(f"# {bin(mask).count('1')}名")
+
+
+def print_expiring(roster, date, days, kinds=None, rank=None, base=None):
+    hits = expiring_within(
+        roster["quals"], roster["records"], date, days, kinds, rank, base
+    )
+    for row in qual_rows(roster["quals"], roster["records"], hits):
+        print("\t".join(row))
+    print(f"# {len(hits)}件")
+
+
+def main(argv=None):
     import argparse
 
+    def shard_spec(value):
+        if value == "base" or (value.isdigit() and int(value) > 0):
+            return value
+        raise argparse.ArgumentTypeError(
+            f"base か 1 以上の人数を指定してください: {value}"
+        )
+
     p = argparse.ArgumentParser()
-    p.add_argument("--schedule", default="schedule.csv")
+    p.add_argument(
+        "--schedule",
+        action="append",
+        help="スケジュールCSV（既定 schedule.csv）。"
+        "--schedule を繰り返して複数指定すると社員番号でまとめて1回で処理する",
+    )
     p.add_argument("--emp", default="emp_no.csv")
     p.add_argument("--pref", default="PREF.xlsx")
-    a = p.parse_args()
-    run(a.schedule, a.emp, a.pref)
+    p.add_argument(
+        "--onboard",
+        choices=["day", "trip"],
+        default="day",
+        help="同乗者の単位（日ごと / 連続乗務のトリップごと）",
+    )
+    p.add_argument(
+        "--onboard-layout",
+        choices=list(ONBOARD_LAYOUTS),
+        default="rows",
+        help="同乗者の出し方（1人1行 / 1日1セルにまとめる / 人数と便別乗員へのリンク）",
+    )
+    p.add_argument("--trip-gap", type=int, default=1, help="同じトリップとみなす日数")
+    p.add_argument("--prev", help="前月のスケジュールCSV、またはキャッシュ済みの年月")
+    p.add_argument("--context-days", type=int, default=7, help="前月から読む日数")
+    p.add_argument("--legality", help="勤務チェックのルール（JSON、既定値に上書き）")
+    p.add_argument(
+        "--shard",
+        type=shard_spec,
+        help="Excel を所属ごと（base）または N 人ずつ（数字）の別ファイルに分ける",
+    )
+    p.add_argument("--shard-dir", default="shards")
+    p.add_argument(
+        "--engine",
+        choices=["openpyxl", "parallel"],
+        default="openpyxl",
+        help="parallel: シート XML を複数プロセスで作って1つのブックにする",
+    )
+    p.add_argument(
+        "--profile",
+        choices=["full", "lite"],
+        default="full",
+        help="lite: 色を条件付き書式にして、勤務を書き換えても色が追従するブック"
+        "（full より小さくはならない）",
+    )
+    p.add_argument("--workers", type=int, help="シャード・parallel で使うプロセス数")
+    p.add_argument(
+        "--reorder-rules",
+        action="store_true",
+        help="色が変わらない範囲で当たりの多い PREF ルールから調べる（full のみ）",
+    )
+    sub = p.add_subparsers(dest="command")
+    q = sub.add_parser("query", help="職番・氏名・2レター・所属・便名の前方一致検索")
+    q.add_argument("text")
+    q.add_argument("--day", help="日付 14 / 2025-07-14（便名の検索をその日に絞る）")
+    q.add_argument("--limit", type=int, default=50)
+    pr = sub.add_parser("pairs", help="同乗回数（蓄積済みの月を合算）")
+    pr.add_argument("--emp", help="社員番号（相手の上位 / 期間内の同乗者）")
+    pr.add_argument("--top", type=int, default=10)
+    pr.add_argument("--min", type=int, dest="threshold", help="この回数以上の組")
+    pr.add_argument("--start", help="開始日 YYYY-MM-DD")
+    pr.add_argument("--end", help="終了日 YYYY-MM-DD")
+    pr.add_argument("--weight", choices=["flights", "days"], default="flights")
+    rc = sub.add_parser("recolor", help="出力済みの Excel の色だけを PREF で付け直す")
+    rc.add_argument("workbook", nargs="?", default="formatted_schedule20.xlsx")
+    rc.add_argument("--out", help="書き出し先（既定は上書き）")
+    tt = sub.add_parser("totals", help="3・6・12か月の H・訓練・乗務日数と便数")
+    tt.add_argument("--end", help="最後の月 YYYYMM（既定は蓄積済みの最新月）")
+    tt.add_argument(
+        "--months", type=int, nargs="+", default=[3, 6, 12], help="集計する月数"
+    )
+    tt.add_argument("--emp", dest="emp_no", help="社員番号")
+    tt.add_argument("--code", help="便名（この便の回数も出す）")
+    tt.add_argument(
+        "--add", nargs="+", help="過去のスケジュールCSVを読み込んで集計に加える"
+    )
+    av = sub.add_parser("avail", help="指定日に H / BLK / 空き などの乗員")
+    av.add_argument("--day", required=True, help="日付 14 / 2025-07-14")
+    av.add_argument("--to", help="この日まで全日が条件に当たる人")
+    av.add_argument(
+        "--class",
+        dest="classes",
+        action="append",
+        choices=DUTY_CLASSES,
+        help="複数指定はいずれか（既定 H）",
+    )
+    av.add_argument("--rank")
+    av.add_argument("--base", help="所属の頭3文字（NVA など）")
+    ex = sub.add_parser("expiring", help="T/O・L/D・PE の期限が近い乗員")
+    ex.add_argument("--date", required=True, help="基準日 YYYY-MM-DD")
+    ex.add_argument("--within", type=int, default=30, help="基準日から何日以内")
+    ex.add_argument("--type", dest="kinds", action="append", choices=list(QUAL_FIELDS))
+    ex.add_argument("--rank")
+    ex.add_argument("--base")
+    a = p.parse_args(argv)
+    # nargs="+" だとサブコマンドまで飲み込むので、ファイルは1つずつ --schedule で渡す
+    a.schedule = a.schedule or ["schedule.csv"]
+    if a.command == "expiring":
+        print_expiring(
+            load_roster(a.schedule, a.emp), a.date, a.within, a.kinds, a.rank, a.base
+        )
+    elif a.command == "avail":
+        print_availability(
+            load_roster(a.schedule, a.emp),
+            a.day,
+            a.to,
+            a.classes or ("H",),
+            a.rank,
+            a.base,
+        )
+    elif a.command == "query":
+        print_query(load_roster(a.schedule, a.emp), a.text, a.day, a.limit)
+    elif a.command == "recolor":
+        from schedule_recolor import recolor
+
+        n = recolor(a.workbook, load_pref_rules(a.pref), a.out or a.workbook)
+        print(f"{n}セルの色を付け直しました: {a.out or a.workbook}")
+    elif a.command == "totals":
+        store = load_cached("totals", kind="store", cache_dir=STORE_DIR)
+        for path in a.add or []:
+            store = update_totals_store(load_roster(path, a.emp))
+        print_totals(store, a.end, a.months, a.emp_no, a.code)
+    elif a.command == "pairs":
+        print_pairs(
+            load_cached("pairing", kind="store", cache_dir=STORE_DIR),
+            a.emp,
+            a.top,
+            a.threshold,
+            a.start,
+            a.end,
+            a.weight,
+        )
+    else:
+        # parallel は full の見た目だけを作る。シャードは openpyxl で書く
+        if a.engine == "parallel" and a.profile == "lite":
+            p.error("--engine parallel と --profile lite は同時に指定できません")
+        if a.engine == "parallel" and a.shard:
+            p.error("--engine parallel と --shard は同時に指定できません")
+        # lite の条件付き書式は並べ替えた順で評価され、見ていない勤務の色が変わりうる
+        if a.reorder_rules and a.profile == "lite":
+            p.error("--reorder-rules と --profile lite は同時に指定できません")
+        run(
+            a.schedule,
+            a.emp,
+            a.pref,
+            a.onboard,
+            a.trip_gap,
+            a.prev,
+            a.context_days,
+            a.legality,
+            a.shard,
+            a.shard_dir,
+            a.workers,
+            a.engine,
+            a.profile,
+            a.reorder_rules,
+            a.onboard_layout,
+        )
+
+
+if __name__ == "__main__":
+    main()
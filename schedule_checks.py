@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# === schedule_checks.py ===
+# 解析済みレコードに対するチェック（勤務の連続日数・休日数など）
+
+import json
+import re
+
+import numpy as np
+
+from schedule_index import flight_tokens, split_flight
+from schedule_stats import crew_base
+
+# ==== Legality ====
+
+DEFAULT_LEGALITY = {
+    # 休日とみなすコード
+    "off_pattern": r"\*?H+(/.*)?",
+    # 休日でも勤務でもないコード（休暇・病欠・未割当など）
+    "non_duty_pattern": r"(VAC|SIK).*|---|\*\*\*",
+    # 連続勤務の上限日数
+    "max_consecutive_duty": 6,
+    # window 日間に最低 days 日の休日
+    "min_off": [{"window": 7, "days": 1}, {"window": 28, "days": 8}],
+    # 休日でも勤務でもない日を含む期間の扱い（skip: 判定しない / rest: 休日と数える）
+    "min_off_non_duty": "skip",
+    # これらの訓練コードの翌日は乗務不可
+    "no_flight_after": ["CATR", "FOTR", "CAT[0-9]"],
+    # 運航便ごとに必要な人数（上位ランクは下位の席に座れる）
+    "rank_order": ["CAP", "FO"],
+    "complement": {"CAP": 1, "FO": 1},
+}
+
+
+def load_legality_rules(path=None):
+    rules = dict(DEFAULT_LEGALITY)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            rules.update(json.load(f))
+    return rules
+
+
+def duty_matrices(records, rules):
+    # 乗員 × 日 の真偽値（勤務 / 休日 / 乗務 / 指定訓練 / 休日でも勤務でもない）
+    n_days = max((len(rec["full_entries"]) for rec in records), default=0)
+    shape = (len(records), n_days)
+    duty = np.zeros(shape, dtype=bool)
+    off = np.zeros(shape, dtype=bool)
+    fly = np.zeros(shape, dtype=bool)
+    trn = np.zeros(shape, dtype=bool)
+    non_duty = np.zeros(shape, dtype=bool)
+    off_re = re.compile(rules["off_pattern"])
+    non_duty_re = re.compile(rules["non_duty_pattern"])
+    trn_re = re.compile("|".join(f"(?:{p})" for p in rules["no_flight_after"]) or "$^")
+    for i, rec in enumerate(records):
+        for d, entries in enumerate(rec["full_entries"]):
+            if not entries:
+                continue
+            if any(off_re.fullmatch(e) for e in entries):
+                off[i, d] = True
+            elif not all(non_duty_re.fullmatch(e) for e in entries):
+                duty[i, d] = True
+            else:
+                non_duty[i, d] = True
+            fly[i, d] = any(not t.endswith("DH") for t in flight_tokens(entries))
+            trn[i, d] = any(trn_re.fullmatch(e) for e in entries)
+    return duty, off, fly, trn, non_duty
+
+
+def _runs(cols):
+    # 連続した列番号をまとめて (始め, 終わり) の組にする
+    runs = []
+    for c in cols:
+        if runs and c == runs[-1][1] + 1:
+            runs[-1][1] = c
+        else:
+            runs.append([c, c])
+    return runs
+
+
+def check_legality(records, rules, dates, offset=0):
+    # offset より前の列は前月分（判定には使うが違反としては出さない）
+    duty, off, fly, trn, non_duty = duty_matrices(records, rules)
+    n_crew, n_days = duty.shape
+    found = []
+
+    limit = rules["max_consecutive_duty"]
+    streak = np.zeros(n_crew, dtype=np.int32)
+    over = np.zeros((n_crew, n_days), dtype=bool)
+    for d in range(n_days):
+        streak = (streak + 1) * duty[:, d]
+        over[:, d] = streak == limit + 1
+    for i, d in zip(*np.nonzero(over)):
+        if d >= offset:
+            found.append((d, i, "連続勤務", f"{limit + 1}日目の勤務"))
+
+    # 休暇・病欠・未割当の日は休日と数えるか、その日を含む期間を判定しない
+    mode = rules.get("min_off_non_duty", "skip")
+    if mode not in ("skip", "rest"):
+        raise ValueError(f"min_off_non_duty は skip か rest です: {mode}")
+    rest = off | non_duty if mode == "rest" else off
+    zero = np.zeros((n_crew, 1), dtype=np.int32)
+    cs = np.concatenate([zero, rest.cumsum(axis=1)], axis=1)
+    cs_non = np.concatenate([zero, non_duty.cumsum(axis=1)], axis=1)
+    for cond in rules["min_off"]:
+        w, need = cond["window"], cond["days"]
+        if n_days < w:
+            continue
+        counts = cs[:, w:] - cs[:, :-w]  # 列 k は k〜k+w-1 日の休日数
+        short = counts < need
+        if mode == "skip":
+            short &= cs_non[:, w:] - cs_non[:, :-w] == 0
+        for i in np.nonzero(short.any(axis=1))[0]:
+            for start, end in _runs(np.nonzero(short[i])[0].tolist()):
+                last = end + w - 1
+                if last < offset:
+                    continue
+                # 続けて足りない期間は1件にまとめる（その場合は範囲が w 日より長い）
+                fewest = int(counts[i, start : end + 1].min())
+                span = f"{dates[start]}〜{dates[last]}"
+                if start == end:
+                    detail = f"{span} の{w}日間で休日 {fewest}日"
+                else:
+                    detail = f"{span} の期間内のいずれかの{w}日間で休日 最少{fewest}日"
+                found.append(
+                    (max(start, offset), i, f"休日不足（{w}日間に{need}日）", detail)
+                )
+
+    after = np.zeros((n_crew, n_days), dtype=bool)
+    after[:, 1:] = trn[:, :-1] & fly[:, 1:]
+    for i, d in zip(*np.nonzero(after)):
+        if d >= offset:
+            prev = " ".join(records[i]["full_entries"][d - 1])
+            found.append((d, i, "訓練翌日の乗務", f"前日: {prev}"))
+
+    found.sort()
+    return [
+        [
+            dates[d],
+            records[i]["emp_no"],
+            records[i]["hdr"][0],
+            records[i].get("rank", ""),
+            crew_base(records[i]),
+            rule,
+            detail,
+        ]
+        for d, i, rule, detail in found
+    ]
+
+
+VIOLATION_HEADER = ["日付", "職番", "氏名", "ランク", "所属", "ルール", "内容"]
+
+
+# ==== Flight complement ====
+
+
+def check_complement(records, flight_index, dates, rules):
+    # DH を除いた乗員のランクで席を上から埋め、足りない便を出す
+    order = rules["rank_order"]
+    need = rules["complement"]
+    found = []
+    for d, tok in sorted(
+        flight_index, key=lambda k: (k[0], int(split_flight(k[1])[0]), k[1])
+    ):
+        number, suffix = split_flight(tok)
+        if suffix == "DH":
+            continue
+        crew = [records[i] for i in flight_index[(d, tok)]]
+        counts = {r: 0 for r in order}
+        unknown = []
+        for rec in crew:
+            if rec.get("rank") in counts:
+                counts[rec["rank"]] += 1
+            else:
+                unknown.append(rec["hdr"][0])
+        problems = []
+        spare = 0
+        for r in order:
+            spare += counts[r] - need.get(r, 0)
+            if spare < 0:
+                problems.append(f"{r}不足 {-spare}名")
+                spare = 0
+        if unknown:
+            problems.append("ランク不明: " + " ".join(unknown))
+        if problems:
+            found.append(
+                [
+                    dates[d],
+                    number,
+                    " ".join(f"{rec['hdr'][0]}({rec.get('rank', '')})" for rec in crew),
+                ]
+                + [counts[r] for r in order]
+                + ["、".join(problems)]
+            )
+    return found
+
+
+def complement_header(rules):
+    return ["日付", "便名", "乗員"] + list(rules["rank_order"]) + ["内容"]
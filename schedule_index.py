@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# === schedule_index.py ===
+# 乗員・便の検索インデックス（解析時に作ってキャッシュに保存する）
+
+import re
+from bisect import bisect_left, insort
+from datetime import date
+
+CREW_FIELDS = ("emp_no", "surname", "roman", "two", "aff")
+
+
+def flight_tokens(entries):
+    # 数字で始まる項目が便。訓練担当の行に並ぶ社員番号（00035957 など）は除く
+    return [
+        e
+        for e in entries
+        if e and re.match(r"^[0-9]", e) and not re.fullmatch(r"000[0-9]{5}", e)
+    ]
+
+
+def header_value(hdr, label):
+    # "ランク：", "CAP" のようにラベルの次にある値を返す（空欄なら ""）
+    if label in hdr:
+        i = hdr.index(label)
+        if i + 1 < len(hdr) and not hdr[i + 1].endswith("："):
+            return hdr[i + 1]
+    return ""
+
+
+def _norm(text):
+    return str(text).strip().upper()
+
+
+def build_search_index(records, dates=None):
+    crew = []
+    flights = []
+    for i, rec in enumerate(records):
+        for field in CREW_FIELDS:
+            v = _norm(rec.get(field, ""))
+            if v:
+                crew.append((v, field, i))
+        # 社員番号はヘッダー表記（00035216）でも引けるようにする
+        if rec["emp_no"]:
+            crew.append(("000" + rec["emp_no"], "emp_no", i))
+        for d, entries in enumerate(rec["full_entries"]):
+            for tok in flight_tokens(entries):
+                flights.append((tok, d, i))
+    crew.sort()
+    flights.sort()
+    days = list(records[0]["dr"]) if records else []
+    dates = list(dates) if dates else ["" for _ in days]
+    return {"crew": crew, "flights": flights, "days": days, "dates": dates}
+
+
+def _prefix_range(items, prefix):
+    lo = bisect_left(items, (prefix,))
+    hi = bisect_left(items, (prefix + "\uffff",), lo)
+    return items[lo:hi]
+
+
+def day_index(days, day, dates=None):
+    # "2025-07-14" → その日付の列、"14" / 14 → その日付ラベルの最初の列（なければ None）
+    if dates and isinstance(day, str) and "-" in day:
+        return dates.index(day) if day in dates else None
+    try:
+        n = int(day)
+    except (TypeError, ValueError):
+        return None
+    for i, label in enumerate(days):
+        if label and int(label) == n:
+            return i
+    return None
+
+
+def day_dates(month, days):
+    # 先頭の年月（"202507"）から日付ラベルを順にたどり、日が戻ったら翌月とする
+    # 空の列・存在しない日付（6/31 など）は ""
+    if not re.fullmatch(r"[0-9]{6}", month or ""):
+        return ["" for _ in days]
+    y, m = int(month[:4]), int(month[4:])
+    prev = 0
+    dates = []
+    for v in days:
+        if not v:
+            dates.append("")
+            continue
+        if int(v) < prev:
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        prev = int(v)
+        try:
+            dates.append(date(y, m, int(v)).isoformat())
+        except ValueError:
+            dates.append("")
+    return dates
+
+
+def search(index, text, day=None, limit=None):
+    # 前方一致。day を指定したときは便だけを検索する
+    q = _norm(text)
+    if not q:
+        return {"crew": [], "flights": []}
+    crew = [] if day is not None else _prefix_range(index["crew"], q)
+    flights = _prefix_range(index["flights"], q)
+    if day is not None:
+        d = day_index(index["days"], day, index.get("dates"))
+        flights = [f for f in flights if f[1] == d]
+    # 同じ人が複数の項目で当たっても1件にまとめる
+    seen = set()
+    uniq = []
+    for key, field, i in crew:
+        if i not in seen:
+            seen.add(i)
+            uniq.append((key, field, i))
+    if limit:
+        uniq = uniq[:limit]
+        flights = flights[:limit]
+    return {"crew": uniq, "flights": flights}
+
+
+# ==== Flight index ====
+
+
+def split_flight(token):
+    # "919" → ("919", ""), "125DH" → ("125", "DH")
+    m = re.match(r"([0-9]+)(.*)", token)
+    return (m.group(1), m.group(2).strip()) if m else (token, "")
+
+
+def build_flight_index(records):
+    # (列番号, 便トークン) → その便に乗っているレコード番号（昇順）
+    index = {}
+    for i, rec in enumerate(records):
+        for d, entries in enumerate(rec["full_entries"]):
+            for tok in flight_tokens(entries):
+                rows = index.setdefault((d, tok), [])
+                if not rows or rows[-1] != i:
+                    rows.append(i)
+    return index
+
+
+def onboard_day(records, flight_index, i, d):
+    others = sorted(
+        {
+            j
+            for tok in flight_tokens(records[i]["full_entries"][d])
+            for j in flight_index.get((d, tok), ())
+            if j != i
+        }
+    )
+    return list(dict.fromkeys(records[j]["hdr"][0] for j in others))
+
+
+def onboard_names(records, flight_index, i):
+    return [
+        onboard_day(records, flight_index, i, d)
+        for d in range(len(records[i]["full_entries"]))
+    ]
+
+
+MANIFEST_HEADER = ["日付", "便名", "区分", "職番", "氏名", "ランク", "所属"]
+
+
+def flight_order(flight_index):
+    # 日付 → 便名（数値順）の順に並べた (列番号, 便トークン)
+    return sorted(flight_index, key=lambda k: (k[0], int(split_flight(k[1])[0]), k[1]))
+
+
+def manifest_rows(records, flight_index, days):
+    rows = []
+    for d, tok in flight_order(flight_index):
+        number, suffix = split_flight(tok)
+        kind = "DH" if suffix == "DH" else "運航"
+        for i in flight_index[(d, tok)]:
+            rec = records[i]
+            rows.append(
+                [
+                    days[d] if d < len(days) else "",
+                    number,
+                    kind,
+                    rec["emp_no"],
+                    rec["hdr"][0],
+                    rec.get("rank", ""),
+                    rec["aff"],
+                ]
+            )
+    return rows
+
+
+def manifest_positions(flight_index, first_row=2):
+    # (列番号, 便トークン) → manifest_rows の表でその便が始まる行（見出しが1行目）
+    positions = {}
+    r = first_row
+    for key in flight_order(flight_index):
+        positions[key] = r
+        r += len(flight_index[key])
+    return positions
+
+
+def manifest_links(rec, positions):
+    # 日ごとに、その日の最初の便の行（便がなければ None）
+    return [
+        min(
+            (
+                positions[(d, tok)]
+                for tok in flight_tokens(entries)
+                if (d, tok) in positions
+            ),
+            default=None,
+        )
+        for d, entries in enumerate(rec["full_entries"])
+    ]
+
+
+# ==== What-if edits ====
+
+
+def whatif_copy(roster):
+    # 編集用の複製（キャッシュ済みの roster は書き換えない）
+    records = [
+        dict(
+            rec,
+            full_entries=list(rec["full_entries"]),
+            sched=list(rec["sched"]),
+            onb=list(rec["onb"]),
+        )
+        for rec in roster["records"]
+    ]
+    flights = {k: list(v) for k, v in roster["flights"].items()}
+    return dict(roster, records=records, flights=flights, edits=[])
+
+
+def edit_duty(roster, i, d, entries):
+    # i 番目の乗員の d 列目を entries に置き換え、その日の便の索引と同乗者だけ直す
+    # 戻り値は同乗者が変わりうるレコード番号（本人を含む）
+    records = roster["records"]
+    flights = roster["flights"]
+    rec = records[i]
+    old = flight_tokens(rec["full_entries"][d])
+    entries = [e.strip() for e in entries if e.strip()]
+    new = flight_tokens(entries)
+    affected = {i}
+    for tok in old:
+        rows = flights.get((d, tok), [])
+        affected.update(rows)
+        if i in rows:
+            rows.remove(i)
+        if not rows:
+            flights.pop((d, tok), None)
+    for tok in new:
+        rows = flights.setdefault((d, tok), [])
+        affected.update(rows)
+        if i not in rows:
+            insort(rows, i)
+    rec["full_entries"][d] = entries
+    if d < len(rec["sched"]):
+        rec["sched"][d] = "\n".join(entries)
+    for j in affected:
+        records[j]["onb"][d] = onboard_day(records, flights, j, d)
+    roster["edits"].append((rec["emp_no"], d, entries))
+    return sorted(affected)
+
+
+# ==== Trips ====
+
+
+def build_trips(records, max_gap=1):
+    # 乗員ごとに、便のある日が max_gap 日以内で続く区間を1つのトリップにまとめる
+    trips = []
+    for rec in records:
+        crew_trips = []
+        for d, entries in enumerate(rec["full_entries"]):
+            for tok in flight_tokens(entries):
+                if crew_trips and d - crew_trips[-1][-1][0] <= max_gap:
+                    crew_trips[-1].append((d, tok))
+                else:
+                    crew_trips.append([(d, tok)])
+        trips.append(crew_trips)
+    return trips
+
+
+def trip_partners(flight_index, i, trip):
+    # トリップ中に同じ便に乗った相手 → 共通の便数
+    shared = {}
+    for leg in trip:
+        for j in flight_index.get(leg, ()):
+            if j != i:
+                shared[j] = shared.get(j, 0) + 1
+    return shared
+
+
+def trip_onboard_names(records, flight_index, trips, i):
+    # トリップ中の各日にトリップ全体の同乗者を並べる
+    onb = [[] for _ in records[i]["full_entries"]]
+    for trip in trips[i]:
+        shared = trip_partners(flight_index, i, trip)
+        names = list(dict.fromkeys(records[j]["hdr"][0] for j in sorted(shared)))
+        for d in {d for d, _ in trip}:
+            onb[d] = names
+    return onb
+
+
+# ==== Month boundary ====
+
+
+def timeline_roster(roster, prev_roster, days):
+    # 前月の末尾 days 日分を先頭につないだ連続したタイムライン（前月がなければそのまま）
+    # 前月側は当月の最初の日付より前の列だけを使う（同じ月・重なる月を渡されても二重にしない）
+    first = next((d for d in roster.get("dates", []) if d), "")
+    prev_dates = (prev_roster or {}).get("dates", [])
+    cols = [c for c, d in enumerate(prev_dates) if d and first and d < first]
+    cols = cols[len(cols) - min(days, len(cols)) :]
+    n = len(cols)
+    prev_by_emp = {
+        rec["emp_no"]: rec
+        for rec in (prev_roster["records"] if n else [])
+        if rec["emp_no"]
+    }
+    records = []
+    for rec in roster["records"]:
+        prev = prev_by_emp.get(rec["emp_no"])
+        tail = [
+            (
+                list(prev["full_entries"][c])
+                if prev and c < len(prev["full_entries"])
+                else []
+            )
+            for c in cols
+        ]
+        records.append(dict(rec, full_entries=tail + rec["full_entries"]))
+    return {
+        "records": records,
+        "offset": n,
+        "dates": [prev_dates[c] for c in cols] + list(roster.get("dates", [])),
+        "flights": build_flight_index(records) if n else roster["flights"],
+    }
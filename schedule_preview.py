@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# === schedule_preview.py ===
+# キャッシュ済みレコードから画面表示用の HTML を組み立てる（1ページ分だけ）
+
+import html
+from urllib.parse import urlencode
+
+from generate_schedule import pref_color
+
+PREVIEW_CSS = (
+    "<style>"
+    ".sk{border-collapse:collapse;margin-bottom:12px}"
+    ".sk td{padding:2px 4px;font-size:11px;white-space:pre-wrap;vertical-align:top}"
+    ".sk .h{border-top:3px double #000;border-bottom:3px double #000}"
+    ".sk .d{text-align:center;vertical-align:middle}"
+    "</style>"
+)
+
+
+def color_lookup(rules, fallback_color="DDDDDD"):
+    # 同じセル文字列は何度も出てくるので判定結果をメモする
+    memo = {}
+
+    def color_of(text):
+        if text not in memo:
+            memo[text] = pref_color(text, rules, fallback_color)
+        return memo[text]
+
+    return color_of
+
+
+def page_count(records, page_size):
+    return max(1, -(-len(records) // page_size))
+
+
+def name_pages(records, page_size):
+    return {
+        rec["hdr"][0]: (i // page_size, rec["emp_no"]) for i, rec in enumerate(records)
+    }
+
+
+def crew_anchor(emp_no):
+    return f"crew-{emp_no}"
+
+
+def page_href(params, page, emp_no=None):
+    q = dict(params, page=page + 1)
+    href = "?" + urlencode(q)
+    if emp_no:
+        href += "#" + crew_anchor(emp_no)
+    return href
+
+
+def _td(text, cls="", color=None):
+    attrs = f' class="{cls}"' if cls else ""
+    if color:
+        attrs += f' style="background:#{color}"'
+    return f"<td{attrs}>{text}</td>"
+
+
+def render_block_html(rec, color_of, emp_aff_map, pages, params):
+    e = html.escape
+    self_name = rec["hdr"][0]
+    rows = []
+    rows.append("".join(_td(e(v), "h") for v in rec["hdr"]))
+    rows.append(
+        "".join(_td(e(v), "d", color_of(s)) for v, s in zip(rec["dr"], rec["sched"]))
+    )
+    rows.append("".join(_td(e(v)) for v in rec["sched"]))
+    onb = rec.get("onb", [])
+    max_onb = max((len(day) for day in onb if day), default=1)
+    for i in range(max_onb):
+        cells = []
+        for names in onb:
+            value = names[i] if i < len(names) else ""
+            if not value or value == self_name:
+                cells.append(_td(""))
+                continue
+            target = pages.get(value)
+            text = e(value)
+            if target:
+                href = e(page_href(params, target[0], target[1]))
+                text = f'<a href="{href}" target="_self">{text}</a>'
+            color = None
+            if target and emp_aff_map.get(target[1]) == rec["aff"]:
+                color = "FFEE99"
+            cells.append(_td(text, color=color))
+        rows.append("".join(cells))
+    body = "".join(f"<tr>{r}</tr>" for r in rows)
+    return (
+        f'<div id="{crew_anchor(rec["emp_no"])}" style="overflow-x:auto">'
+        f'<table class="sk">{body}</table></div>'
+    )
+
+
+def render_page_html(records, page, page_size, color_of, emp_aff_map, params, pages):
+    start = page * page_size
+    return PREVIEW_CSS + "".join(
+        render_block_html(rec, color_of, emp_aff_map, pages, params)
+        for rec in records[start : start + page_size]
+    )
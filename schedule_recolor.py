@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# === schedule_recolor.py ===
+# 出力済みのブックの日付行の色だけを PREF のルールで付け直す（元の CSV は不要）
+# 1) 読み取り専用で日付行と勤務の文字列を拾う
+# 2) styles.xml に塗りだけ変えた書式を足し、シート XML の s= を書き換える
+
+import os
+import re
+import zipfile
+
+from openpyxl import load_workbook
+
+from generate_schedule import pref_color
+
+FALLBACK = "DDDDDD"
+
+
+def _rewind(src):
+    if hasattr(src, "seek"):
+        src.seek(0)
+    return src
+
+
+def find_date_cells(src):
+    # ヘッダー行（職番：・ランク：を含む行）の次が日付行、その次が勤務の行
+    wb = load_workbook(_rewind(src), read_only=True)
+    ws = wb.worksheets[0]
+    cells = {}
+    rows = ws.iter_rows(values_only=True)
+    r = 0
+    pending = None
+    for values in rows:
+        r += 1
+        if pending == "date":
+            date_row = r
+            pending = "sched"
+            continue
+        if pending == "sched":
+            for j, v in enumerate(values, start=1):
+                cells[(date_row, j)] = "" if v is None else str(v)
+            pending = None
+            continue
+        if "職番：" in values or "ランク：" in values:
+            pending = "date"
+    wb.close()
+    return cells
+
+
+def _first_sheet_path(z):
+    workbook = z.read("xl/workbook.xml").decode("utf-8")
+    rid = re.search(r'<sheet\b[^>]*\br:id="([^"]+)"', workbook).group(1)
+    rels = z.read("xl/_rels/workbook.xml.rels").decode("utf-8")
+    for rel in re.findall(r"<Relationship\b[^>]*>", rels):
+        if f'Id="{rid}"' in rel:
+            target = re.search(r'Target="([^"]+)"', rel).group(1)
+            return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    raise ValueError("シートが見つかりません")
+
+
+def _col_row(ref):
+    m = re.fullmatch(r"([A-Z]+)([0-9]+)", ref)
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + ord(ch) - 64
+    return int(m.group(2)), col
+
+
+def _patch_styles(styles, wanted):
+    # wanted: (元の xf 番号, 色) の並び → 塗りだけ差し替えた xf を末尾に足す
+    fills = re.search(r"<fills\b[^>]*>(.*?)</fills>", styles, re.S)
+    n_fills = len(re.findall(r"<fill\b", fills.group(1)))
+    xfs = re.search(r"<cellXfs\b[^>]*>(.*?)</cellXfs>", styles, re.S)
+    xf_list = re.findall(r"<xf\b[^>]*/>|<xf\b.*?</xf>", xfs.group(1), re.S)
+    fill_id = {"": 0}
+    new_fills = []
+    new_xfs = []
+    xf_id = {}
+    for old, color in wanted:
+        if color not in fill_id:
+            fill_id[color] = n_fills + len(new_fills)
+            new_fills.append(
+                '<fill><patternFill patternType="solid">'
+                f'<fgColor rgb="00{color}"/><bgColor indexed="64"/>'
+                "</patternFill></fill>"
+            )
+        xf = xf_list[old]
+        xf = re.sub(r'\sfillId="[0-9]+"', "", xf)
+        xf = re.sub(r'\sapplyFill="[0-9]+"', "", xf)
+        xf = xf.replace("<xf", f'<xf fillId="{fill_id[color]}" applyFill="1"', 1)
+        xf_id[(old, color)] = len(xf_list) + len(new_xfs)
+        new_xfs.append(xf)
+    styles = (
+        styles[: fills.start()]
+        + f'<fills count="{n_fills + len(new_fills)}">'
+        + fills.group(1)
+        + "".join(new_fills)
+        + "</fills>"
+        + styles[fills.end() :]
+    )
+    xfs = re.search(r"<cellXfs\b[^>]*>(.*?)</cellXfs>", styles, re.S)
+    styles = (
+        styles[: xfs.start()]
+        + f'<cellXfs count="{len(xf_list) + len(new_xfs)}">'
+        + xfs.group(1)
+        + "".join(new_xfs)
+        + "</cellXfs>"
+        + styles[xfs.end() :]
+    )
+    return styles, xf_id
+
+
+def recolor(src, pref_rules, dst, fallback_color=FALLBACK):
+    # 戻り値は色を付け直した日付セルの数
+    cells = find_date_cells(src)
+    memo = {}
+    colors = {}
+    for key, text in cells.items():
+        if text not in memo:
+            memo[text] = (pref_color(text, pref_rules, fallback_color) or "").upper()
+        colors[key] = memo[text]
+
+    with zipfile.ZipFile(_rewind(src)) as z:
+        sheet_path = _first_sheet_path(z)
+        sheet = z.read(sheet_path).decode("utf-8")
+        styles = z.read("xl/styles.xml").decode("utf-8")
+        entries = [(info, z.read(info.filename)) for info in z.infolist()]
+
+    # 日付セルの今の書式番号を拾い、(書式, 色) ごとに新しい書式を1つだけ作る
+    cell_re = re.compile(r'<c\b[^>]*\br="([A-Z]+[0-9]+)"[^>]*>')
+    current = {}
+    for m in cell_re.finditer(sheet):
+        key = _col_row(m.group(1))
+        if key in colors:
+            s = re.search(r'\bs="([0-9]+)"', m.group(0))
+            current[key] = int(s.group(1)) if s else 0
+    wanted = sorted({(current[k], colors[k]) for k in current})
+    styles, xf_id = _patch_styles(styles, wanted)
+
+    def restyle(m):
+        key = _col_row(m.group(1))
+        if key not in current:
+            return m.group(0)
+        tag = re.sub(r'\ss="[0-9]+"', "", m.group(0))
+        return tag.replace("<c", f'<c s="{xf_id[(current[key], colors[key])]}"', 1)
+
+    sheet = cell_re.sub(restyle, sheet)
+    # 以前のルールから作った条件付き書式は色と食い違うので外す
+    sheet = re.sub(
+        r"<conditionalFormatting\b.*?</conditionalFormatting>", "", sheet, flags=re.S
+    )
+
+    replaced = {
+        sheet_path: sheet.encode("utf-8"),
+        "xl/styles.xml": styles.encode("utf-8"),
+    }
+    tmp = dst + ".tmp" if isinstance(dst, str) else dst
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as out:
+        for info, data in entries:
+            out.writestr(info, replaced.get(info.filename, data))
+    if isinstance(dst, str):
+        os.replace(tmp, dst)
+    return len(current)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# === schedule_rules.py ===
+# PREF ルールの判定を速くする仕組み（固定文字列のパターンはまとめて1回で探す）
+
+import re
+from collections import deque
+from functools import lru_cache
+
+
+def pattern_terms(pattern):
+    # 行単位の正規表現を (行頭か, 文字列, 行末か) の OR に分解する
+    # 固定文字列・^ / $ 付き・(A|B) の選択だけを扱い、それ以外は None
+    if not pattern:
+        return []
+    p = pattern
+    depth = 0
+    wrapped = p.startswith("(") and p.endswith(")")
+    for k, ch in enumerate(p):
+        depth += {"(": 1, ")": -1}.get(ch, 0)
+        if depth == 0 and k < len(p) - 1:
+            wrapped = False
+    if wrapped:
+        p = p[1:-1]
+    alts = []
+    depth = 0
+    start = 0
+    for k, ch in enumerate(p):
+        depth += {"(": 1, ")": -1}.get(ch, 0)
+        if ch == "|" and depth == 0:
+            alts.append(p[start:k])
+            start = k + 1
+    alts.append(p[start:])
+    terms = []
+    for alt in alts:
+        m = re.fullmatch(r"(\^?)(?:\(([^()]*)\)|([^()|$]*))(\$?)", alt)
+        if not m:
+            return None
+        words = (m.group(2) if m.group(2) is not None else m.group(3)).split("|")
+        for w in words:
+            if not w or re.search(r"[.^$*+?{}\[\]\\|()]", w):
+                return None
+            terms.append((bool(m.group(1)), w, bool(m.group(4))))
+    return terms
+
+
+# ==== Aho-Corasick ====
+
+
+def build_automaton(words):
+    # goto[状態][文字] → 状態、out[状態] = その状態で見つかる語の番号
+    goto = [{}]
+    out = [[]]
+    for k, word in enumerate(words):
+        state = 0
+        for ch in word:
+            if ch not in goto[state]:
+                goto.append({})
+                out.append([])
+                goto[state][ch] = len(goto) - 1
+            state = goto[state][ch]
+        out[state].append(k)
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for ch, nxt in goto[state].items():
+            f = fail[state]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            # 根の直下は根へ戻る（自分自身を指さない）
+            fail[nxt] = goto[f][ch] if state and ch in goto[f] else 0
+            out[nxt] = out[nxt] + out[fail[nxt]]
+            queue.append(nxt)
+    return {"goto": goto, "fail": fail, "out": out, "words": words}
+
+
+def find_words(automaton, text):
+    # text の中の語の出現 (開始位置, 終了位置, 語の番号)
+    goto, fail, out, words = (
+        automaton["goto"],
+        automaton["fail"],
+        automaton["out"],
+        automaton["words"],
+    )
+    state = 0
+    for i, ch in enumerate(text):
+        while state and ch not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(ch, 0)
+        for k in out[state]:
+            yield i + 1 - len(words[k]), i + 1, k
+
+
+# ==== Rule matcher ====
+
+
+def compile_rules(rules):
+    # 各ルールの first / second を「固定文字列の語の組」か「正規表現」にする
+    words = []
+    word_id = {}
+    terms = []  # 語の番号 → [(行頭か, 行末か, パターン番号)]
+    patterns = []  # パターン番号 → ("terms", None) / ("regex", compiled) / None（空）
+    for rule in rules:
+        for key in ("first", "second"):
+            p = rule[key] or ""
+            pid = len(patterns)
+            if not p:
+                patterns.append(None)
+                continue
+            split = pattern_terms(p)
+            if split is None:
+                patterns.append(("regex", re.compile(p)))
+                continue
+            patterns.append(("terms", None))
+            for head, word, tail in split:
+                if word not in word_id:
+                    word_id[word] = len(words)
+                    words.append(word)
+                    terms.append([])
+                terms[word_id[word]].append((head, tail, pid))
+    # 正規表現を含むルールと、両方空の NONE は毎回調べる
+    # それ以外は語が見つかったときだけ候補にする
+    ops = [rule["op"].upper() for rule in rules]
+    always = [
+        k
+        for k, op in enumerate(ops)
+        if any(
+            patterns[pid] and patterns[pid][0] == "regex" for pid in (2 * k, 2 * k + 1)
+        )
+        or (op == "NONE" and patterns[2 * k] is None and patterns[2 * k + 1] is None)
+    ]
+    return {
+        "ops": ops,
+        "always": always,
+        "patterns": patterns,
+        "terms": terms,
+        "automaton": build_automaton(words),
+    }
+
+
+def rule_checks(matcher, text):
+    # 当たりうるルールをシートの順に調べ、(ルール番号, 当たったか) を返していく
+    lines = str(text).split("\n")
+    found = set()
+    terms = matcher["terms"]
+    for line in lines:
+        n = len(line)
+        for start, end, k in find_words(matcher["automaton"], line):
+            for head, tail, pid in terms[k]:
+                if (not head or start == 0) and (not tail or end == n):
+                    found.add(pid)
+    patterns = matcher["patterns"]
+
+    def hit(pid):
+        kind = patterns[pid]
+        if kind is None:
+            return False
+        if kind[0] == "terms":
+            return pid in found
+        return any(kind[1].search(line) for line in lines)
+
+    ops = matcher["ops"]
+    for k in sorted(set(matcher["always"]).union(pid // 2 for pid in found)):
+        op = ops[k]
+        c1, c2 = hit(2 * k), hit(2 * k + 1)
+        empty = patterns[2 * k] is None and patterns[2 * k + 1] is None
+        yield k, (
+            (op == "AND" and c1 and c2)
+            or (op == "OR" and (c1 or c2))
+            or (op == "NONE" and (c1 or c2 or empty))
+        )
+
+
+def match_index(matcher, text):
+    # pref_rule_index と同じ結果（最初に当たったルールの番号、なければ None）
+    for k, ok in rule_checks(matcher, text):
+        if ok:
+            return k
+    return None
+
+
+@lru_cache(maxsize=16)
+def _compiled(key):
+    return compile_rules([{"first": f, "op": op, "second": s} for f, op, s in key])
+
+
+# 直前に使ったルールのリストと matcher（セルごとの呼び出しでは中身を見ずに使い回す）
+# （Streamlit のスレッドから同時に呼ばれても組がずれないよう、タプルごと差し替える）
+_LAST = (None, None)
+
+
+def rule_matcher(rules):
+    global _LAST
+    # 中身が同じルールには同じ matcher を使い回す（作り直したリストでも再コンパイルしない）
+    last_rules, matcher = _LAST
+    if last_rules is rules:
+        return matcher
+    key = tuple((r["first"], r["op"], r["second"]) for r in rules)
+    matcher = _compiled(key)
+    _LAST = (rules, matcher)
+    return matcher
+
+
+# ==== Rule statistics ====
+
+
+def cell_texts(records):
+    # 勤務のセルの文字列 → 出てくる回数
+    counts = {}
+    for rec in records:
+        for text in rec["sched"]:
+            counts[text] = counts.get(text, 0) + 1
+    return counts
+
+
+def rule_stats(rules, text_counts):
+    # hits: 最初に当たったセル数（最後の要素は一致なし）
+    # evals: 最初に当たるまでに調べたセル数、matches: 順番に関係なく条件に合うセル数
+    # shadowed_by: 条件に合うのに先のルールが当たったセル数（先のルール番号 → セル数）
+    matcher = rule_matcher(rules)
+    n = len(rules)
+    stats = {
+        "hits": [0] * (n + 1),
+        "evals": [0] * n,
+        "matches": [0] * n,
+        "shadowed_by": [{} for _ in rules],
+        "both": set(),
+    }
+    for text, count in text_counts.items():
+        first = None
+        matched = []
+        for k, ok in rule_checks(matcher, text):
+            if first is None:
+                stats["evals"][k] += count
+            if ok:
+                matched.append(k)
+                first = k if first is None else first
+        stats["hits"][n if first is None else first] += count
+        for k in matched:
+            stats["matches"][k] += count
+            if k != first:
+                shadow = stats["shadowed_by"][k]
+                shadow[first] = shadow.get(first, 0) + count
+        # 同じセルに当たった組（並べ替えの判定に使う）
+        stats["both"].update((j, k) for j in matched for k in matched if j < k)
+    return stats
+
+
+def rule_state(stats, k):
+    if not stats["matches"][k]:
+        return "未使用"
+    if not stats["hits"][k]:
+        return "隠れ"
+    if stats["shadowed_by"][k]:
+        return "一部隠れ"
+    return ""
+
+
+RULE_STATS_HEADER = [
+    "順番",
+    "ラベル",
+    "1行目",
+    "AND/OR",
+    "2行目",
+    "色",
+    "当たったセル",
+    "評価したセル",
+    "条件に合うセル",
+    "状態",
+    "先に当たったルール",
+]
+
+
+def rule_stats_rows(rules, stats):
+    rows = []
+    for k, rule in enumerate(rules):
+        shadow = sorted(stats["shadowed_by"][k].items(), key=lambda x: (-x[1], x[0]))
+        rows.append(
+            [
+                k + 1,
+                rule["label"],
+                rule["first"],
+                rule["op"],
+                rule["second"],
+                rule["color"],
+                stats["hits"][k],
+                stats["evals"][k],
+                stats["matches"][k],
+                rule_state(stats, k),
+                " ".join(f"{j + 1}:{rules[j]['label']}({c})" for j, c in shadow),
+            ]
+        )
+    return rows
+
+
+def reorder_rules(rules, stats):
+    # 当たりの多いルールを前に出す。ただし色の違う2つのルールが同じセルに
+    # 当たったことがあれば元の順を保つ（stats を取ったセルでは結果が変わらない）
+    n = len(rules)
+    before = {k: set() for k in range(n)}
+    for j, k in stats["both"]:
+        if rules[j]["color"] != rules[k]["color"]:
+            before[k].add(j)
+    order = []
+    left = set(range(n))
+    while left:
+        ready = [k for k in left if not before[k] & left]
+        k = min(ready, key=lambda k: (-stats["hits"][k], k))
+        order.append(k)
+        left.remove(k)
+    return [rules[k] for k in order]
+
+
+def total_evals(rules, text_counts):
+    return sum(rule_stats(rules, text_counts)["evals"])
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# === schedule_stats.py ===
+# 解析済みレコードから作る集計（同乗回数・日別の勤務区分・資格期限・日別人数・月別集計など）
+
+import re
+from bisect import bisect_left, bisect_right
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from schedule_index import flight_tokens, header_value, split_flight
+
+# ==== Crew pairing ====
+
+
+def build_pairing(records, flight_index, dates):
+    # 日付の年月ごとの疎行列。キーは社員番号の組 (a, b)（a < b）
+    # 日付のない列（存在しない日付など）は数えない
+    result = {}
+    for m in sorted({d[:4] + d[5:7] for d in dates if d}):
+        result[m] = {
+            "pairs": {},
+            "events": {},
+            "days": sum(1 for d in dates if d and d[:4] + d[5:7] == m),
+        }
+    days = {}
+    for (d, tok), rows in flight_index.items():
+        if not dates[d]:
+            continue
+        m = dates[d][:4] + dates[d][5:7]
+        pairs = result[m]["pairs"]
+        events = result[m]["events"]
+        emps = sorted({records[i]["emp_no"] for i in rows if records[i]["emp_no"]})
+        for a, b in combinations(emps, 2):
+            pairs[(a, b)] = pairs.get((a, b), 0) + 1
+            days.setdefault((m, a, b), set()).add(d)
+        for a in emps:
+            ev = events.setdefault(a, [])
+            ev.extend((dates[d], b, tok) for b in emps if b != a)
+    for m, month in result.items():
+        for ev in month["events"].values():
+            ev.sort()
+        month["pairs"] = {
+            k: [n, len(days[(m,) + k])] for k, n in month["pairs"].items()
+        }
+    return result
+
+
+def merge_pairing(store, pairing):
+    # 月ごとに入れ替える。同じ月は日数の多い方（同じなら新しい方）を残し、
+    # 前後の月に少しはみ出した列で上書きしない（何度実行しても結果は同じ）
+    store = dict(store or {"months": {}})
+    months = dict(store["months"])
+    for m, month in pairing.items():
+        if m not in months or month["days"] >= months[m].get("days", 0):
+            months[m] = month
+    pairs = {}
+    events = {}
+    for m in sorted(months):
+        for k, (n, nd) in months[m]["pairs"].items():
+            total = pairs.setdefault(k, [0, 0])
+            total[0] += n
+            total[1] += nd
+        for emp, ev in months[m]["events"].items():
+            events.setdefault(emp, []).extend(ev)
+    adj = {}
+    for (a, b), w in pairs.items():
+        adj.setdefault(a, {})[b] = w
+        adj.setdefault(b, {})[a] = w
+    return {"months": months, "pairs": pairs, "adj": adj, "events": events}
+
+
+WEIGHTS = {"flights": 0, "days": 1}
+
+
+def top_partners(store, emp, n=10, weight="flights"):
+    w = WEIGHTS[weight]
+    partners = store["adj"].get(emp, {})
+    return sorted(partners.items(), key=lambda kv: (-kv[1][w], kv[0]))[:n]
+
+
+def pairs_above(store, threshold, weight="flights"):
+    w = WEIGHTS[weight]
+    hits = [(k, v) for k, v in store["pairs"].items() if v[w] >= threshold]
+    return sorted(hits, key=lambda kv: (-kv[1][w], kv[0]))
+
+
+def partners_between(store, emp, start, end):
+    # start〜end（ISO 日付、両端含む）に emp と同じ便に乗った人 → 便の一覧
+    ev = store["events"].get(emp, [])
+    lo = bisect_left(ev, (start,))
+    hi = bisect_right(ev, (end, "\uffff"))
+    partners = {}
+    for date, partner, tok in ev[lo:hi]:
+        partners.setdefault(partner, []).append((date, tok))
+    return partners
+
+
+# ==== Availability ====
+
+DUTY_CLASSES = ("H", "BLK", "FREE", "FLY", "DH", "TRN", "CATR")
+
+
+def classify_day(entries):
+    classes = set()
+    if not entries:
+        classes.add("FREE")
+    for e in entries:
+        if re.fullmatch(r"\*?H+(/.*)?", e):
+            classes.add("H")
+        elif e == "BLK":
+            classes.add("BLK")
+        elif e.endswith(" TRN"):
+            classes.add("TRN")
+        elif e == "CATR":
+            classes.add("CATR")
+        elif flight_tokens([e]):
+            classes.add("DH" if e.endswith("DH") else "FLY")
+    return classes
+
+
+def crew_base(rec):
+    # 所属（NVA001 → NVA）。職員番号CSVにない人はヘッダーの所属から同じ形にする
+    if rec["aff"]:
+        return rec["aff"][:3]
+    return header_base(header_value(rec["hdr"], "所属："))
+
+
+def header_base(aff):
+    # ヘッダーの所属は会社（〜Z）の後ろに所属が続く: NVZNVA → NVA, NTZF → NTF
+    m = re.fullmatch(r"([A-Z]{2})Z(.+)", aff)
+    if not m:
+        return aff[:3]
+    rest = m.group(2)
+    return rest[:3] if len(rest) >= 2 else m.group(1) + rest
+
+
+def build_availability(records):
+    # crew_bits[分類][乗員] のビット d = d 列目、day_bits[分類][d] のビット i = 乗員 i
+    n_days = max((len(rec["full_entries"]) for rec in records), default=0)
+    crew_bits = {c: [0] * len(records) for c in DUTY_CLASSES}
+    day_bits = {c: [0] * n_days for c in DUTY_CLASSES}
+    rank = {}
+    base = {}
+    for i, rec in enumerate(records):
+        for d, entries in enumerate(rec["full_entries"]):
+            for c in classify_day(entries):
+                crew_bits[c][i] |= 1 << d
+                day_bits[c][d] |= 1 << i
+        rank[rec.get("rank", "")] = rank.get(rec.get("rank", ""), 0) | 1 << i
+        b = crew_base(rec)
+        base[b] = base.get(b, 0) | 1 << i
+    return {
+        "crew_bits": crew_bits,
+        "day_bits": day_bits,
+        "rank": rank,
+        "base": base,
+        "all": (1 << len(records)) - 1,
+    }
+
+
+def availability_mask(avail, classes, days, rank=None, base=None):
+    # days のすべての日で classes のどれかに当たる乗員のビット列
+    mask = avail["all"]
+    for d in days:
+        day = 0
+        for c in classes:
+            day |= avail["day_bits"][c][d]
+        mask &= day
+    if rank:
+        mask &= avail["rank"].get(rank, 0)
+    if base:
+        mask &= avail["base"].get(base, 0)
+    return mask
+
+
+def mask_members(mask):
+    members = []
+    while mask:
+        low = mask & -mask
+        members.append(low.bit_length() - 1)
+        mask ^= low
+    return members
+
+
+# ==== Qualification expiry ====
+
+QUAL_FIELDS = {"T/O": "T/O期限：", "L/D": "L/D期限：", "PE": "PE："}
+
+
+def build_qual_index(records):
+    # ヘッダーの期限コード（3T250917 / 3L250920 / PE251208）を日付にして期限順に並べる
+    rows = []
+    for i, rec in enumerate(records):
+        for kind, label in QUAL_FIELDS.items():
+            code = header_value(rec["hdr"], label)
+            m = re.search(r"([0-9]{6})$", code)
+            if m:
+                rows.append((kind, code, m.group(1), i))
+    if not rows:
+        return {"items": [], "cat": {}}
+    expiry = pd.to_datetime(
+        pd.Series([r[2] for r in rows]), format="%y%m%d", errors="coerce"
+    ).dt.strftime("%Y-%m-%d")
+    items = sorted(
+        (date, kind, code, i)
+        for (kind, code, _, i), date in zip(rows, expiry)
+        if isinstance(date, str)
+    )
+    cat = {i: header_value(rec["hdr"], "CAT資格：") for i, rec in enumerate(records)}
+    return {"items": items, "cat": cat}
+
+
+def expiring_within(quals, records, date, days, kinds=None, rank=None, base=None):
+    # date から days 日以内（date 当日を含む）に期限が来る資格
+    start = pd.Timestamp(date)
+    end = (start + pd.Timedelta(days=days)).strftime("%Y-%m-%d")
+    items = quals["items"]
+    lo = bisect_left(items, (start.strftime("%Y-%m-%d"),))
+    hi = bisect_right(items, (end, "\uffff"))
+    hits = []
+    for expiry, kind, code, i in items[lo:hi]:
+        rec = records[i]
+        if kinds and kind not in kinds:
+            continue
+        if rank and rec.get("rank") != rank:
+            continue
+        if base and crew_base(rec) != base:
+            continue
+        hits.append((expiry, kind, code, i))
+    return hits
+
+
+QUAL_HEADER = ["期限", "種別", "コード", "職番", "氏名", "ランク", "所属", "CAT資格"]
+
+
+def qual_rows(quals, records, hits=None):
+    return [
+        [
+            expiry,
+            kind,
+            code,
+            records[i]["emp_no"],
+            records[i]["hdr"][0],
+            records[i].get("rank", ""),
+            crew_base(records[i]),
+            quals["cat"].get(i, ""),
+        ]
+        for expiry, kind, code, i in (quals["items"] if hits is None else hits)
+    ]
+
+
+# ==== Staffing ====
+
+
+def bits_matrix(values, n_bits):
+    # Python int のビット列の並び → (len(values), n_bits) の 0/1 配列
+    n_bytes = max(1, -(-n_bits // 8))
+    buf = b"".join(v.to_bytes(n_bytes, "little") for v in values)
+    arr = np.frombuffer(buf, dtype=np.uint8).reshape(len(values), n_bytes)
+    return np.unpackbits(arr, axis=1, bitorder="little")[:, :n_bits]
+
+
+def build_staffing(records, avail, n_days):
+    # 日 × 勤務区分 × (所属, ランク) の人数
+    groups = sorted({(crew_base(r), r.get("rank", "")) for r in records})
+    gidx = {g: k for k, g in enumerate(groups)}
+    onehot = np.zeros((len(records), len(groups)), dtype=np.int32)
+    onehot[
+        np.arange(len(records)),
+        [gidx[(crew_base(r), r.get("rank", ""))] for r in records],
+    ] = 1
+    tensor = np.stack(
+        [bits_matrix(avail["crew_bits"][c], n_days) for c in DUTY_CLASSES]
+    ).astype(np.int32)
+    counts = np.einsum("cid,ig->dcg", tensor, onehot)
+    return {"counts": counts, "groups": groups, "classes": DUTY_CLASSES}
+
+
+def staffing_rows(staffing, days):
+    # 日付のない列（埋め草や 6/31 のような存在しない日付）は出さない
+    counts = staffing["counts"]
+    rows = []
+    for d in range(counts.shape[0]):
+        if d >= len(days) or not days[d]:
+            continue
+        for g, (base, rank) in enumerate(staffing["groups"]):
+            rows.append([days[d], base, rank] + counts[d, :, g].tolist())
+        rows.append([days[d], "計", ""] + counts[d].sum(axis=1).tolist())
+    return rows
+
+
+def staffing_header(staffing):
+    return ["日付", "所属", "ランク"] + list(staffing["classes"])
+
+
+# ==== Monthly totals ====
+
+# 集計する日数の列（訓練日は TRN と CATR のどちらか）
+TOTAL_CLASSES = {"H": ("H",), "TRN": ("TRN", "CATR"), "FLY": ("FLY",), "DH": ("DH",)}
+
+
+def month_totals(records, avail, flight_index, dates):
+    # 日付の年月ごとに 乗員 × 列（日数の分類 + 便名ごとの便数）の件数をまとめる
+    n_days = len(dates)
+    flags = {
+        name: np.logical_or.reduce(
+            [bits_matrix(avail["crew_bits"][c], n_days) for c in classes]
+        )
+        for name, classes in TOTAL_CLASSES.items()
+    }
+    codes = sorted(
+        {
+            split_flight(tok)[0]
+            for _, tok in flight_index
+            if split_flight(tok)[1] != "DH"
+        },
+        key=lambda c: (int(c), c),
+    )
+    columns = list(TOTAL_CLASSES) + [f"便:{c}" for c in codes]
+    col = {c: k for k, c in enumerate(codes, len(TOTAL_CLASSES))}
+    months = sorted({d[:4] + d[5:7] for d in dates if d})
+    month_of = [months.index(d[:4] + d[5:7]) if d else -1 for d in dates]
+    counts = np.zeros((len(months), len(records), len(columns)), dtype=np.int32)
+    for k, name in enumerate(TOTAL_CLASSES):
+        for m in range(len(months)):
+            cols = [d for d in range(n_days) if month_of[d] == m]
+            counts[m, :, k] = flags[name][:, cols].sum(axis=1)
+    for (d, tok), rows in flight_index.items():
+        number, suffix = split_flight(tok)
+        if suffix != "DH" and month_of[d] >= 0:
+            counts[month_of[d], rows, col[number]] += 1
+    # 同じ社員番号のレコードが複数あれば合算する
+    emps = sorted({rec["emp_no"] for rec in records if rec["emp_no"]})
+    row = {e: k for k, e in enumerate(emps)}
+    keep = [i for i, rec in enumerate(records) if rec["emp_no"]]
+    target = [row[records[i]["emp_no"]] for i in keep]
+    result = {}
+    for k, m in enumerate(months):
+        merged = np.zeros((len(emps), len(columns)), dtype=np.int32)
+        np.add.at(merged, target, counts[k][keep])
+        result[m] = {
+            "emps": emps,
+            "columns": columns,
+            "counts": merged,
+            "days": month_of.count(k),
+        }
+    return result
+
+
+def merge_totals(store, totals):
+    # 同じ月は日数の多い方（同じなら新しい方）を残す。前後の月に少しはみ出した列で上書きしない
+    months = dict((store or {}).get("months", {}))
+    for m, t in totals.items():
+        if m not in months or t["days"] >= months[m]["days"]:
+            months[m] = t
+    return {"months": months}
+
+
+def rolling_totals(store, end, n):
+    # end（YYYYMM）までの n か月分を社員番号・列の和集合にそろえて足し合わせる
+    y, m = int(end[:4]), int(end[4:])
+    window = []
+    for _ in range(n):
+        window.append(f"{y:04d}{m:02d}")
+        y, m = (y - 1, 12) if m == 1 else (y, m - 1)
+    parts = [store["months"][k] for k in reversed(window) if k in store["months"]]
+    emps = sorted({e for p in parts for e in p["emps"]})
+    columns = list(TOTAL_CLASSES) + sorted(
+        {c for p in parts for c in p["columns"][len(TOTAL_CLASSES) :]},
+        key=lambda c: (int(c[2:]), c),
+    )
+    row = {e: k for k, e in enumerate(emps)}
+    col = {c: k for k, c in enumerate(columns)}
+    counts = np.zeros((len(emps), len(columns)), dtype=np.int32)
+    for p in parts:
+        counts[
+            np.ix_([row[e] for e in p["emps"]], [col[c] for c in p["columns"]])
+        ] += p["counts"]
+    return {
+        "emps": emps,
+        "columns": columns,
+        "counts": counts,
+        "months": [k for k in reversed(window) if k in store["months"]],
+    }
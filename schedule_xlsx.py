@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# === schedule_xlsx.py ===
+# シート XML を複数プロセスで作り、1つの .xlsx にまとめて書く
+# 各プロセスは担当する行の XML と自分の共有文字列だけを返し、
+# スタイルと共有文字列の番号付けはまとめる側が決める（同じ入力なら同じファイル）
+
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+
+from generate_schedule import HIGHLIGHT_TEXT, MANIFEST_SHEET, block_rows, pref_color
+from schedule_index import manifest_links
+
+HIGHLIGHT = "FFEE99"
+FALLBACK = "DDDDDD"
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS = f'xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"'
+XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# ==== Styles ====
+
+
+def build_palette(pref_rules):
+    # 使いうる塗りの色（規則の色 + 既定色 + 同じ所属の強調）を決まった順に並べる
+    colors = [FALLBACK, HIGHLIGHT]
+    for rule in pref_rules:
+        c = rule["color"].lstrip("#").upper()
+        if c and c not in colors:
+            colors.append(c)
+    return colors
+
+
+ALIGN_WRAP = '<alignment horizontal="left" vertical="top" wrapText="1"/>'
+ALIGN_NOWRAP = '<alignment horizontal="left" vertical="top"/>'
+ALIGN_DATE = '<alignment horizontal="center" vertical="center" wrapText="1"/>'
+
+
+def cell_styles(palette):
+    # セルの種類 → (fillId, borderId, alignment)。並び順がそのまま cellXfs の番号
+    styles = {
+        "plain": (0, 0, ""),
+        "header": (0, 1, ALIGN_WRAP),
+        "header_nowrap": (0, 1, ALIGN_NOWRAP),
+        "wrap": (0, 0, ALIGN_WRAP),
+        "highlight": (2 + palette.index(HIGHLIGHT), 0, ALIGN_WRAP),
+        ("date", ""): (0, 0, ALIGN_DATE),
+    }
+    for k, c in enumerate(palette):
+        styles[("date", c)] = (2 + k, 0, ALIGN_DATE)
+    return styles
+
+
+def style_ids(palette):
+    return {key: k for k, key in enumerate(cell_styles(palette))}
+
+
+def styles_xml(palette):
+    fills = ['<fill><patternFill patternType="none"/></fill>']
+    fills.append('<fill><patternFill patternType="gray125"/></fill>')
+    for c in palette:
+        fills.append(
+            '<fill><patternFill patternType="solid">'
+            f'<fgColor rgb="00{c}"/><bgColor indexed="64"/></patternFill></fill>'
+        )
+    double = '<color rgb="FF000000"/>'
+    borders = [
+        "<border><left/><right/><top/><bottom/><diagonal/></border>",
+        f'<border><left/><right/><top style="double">{double}</top>'
+        f'<bottom style="double">{double}</bottom><diagonal/></border>',
+    ]
+    xfs = []
+    for fill, border, align in cell_styles(palette).values():
+        attrs = f'numFmtId="0" fontId="0" fillId="{fill}" borderId="{border}" xfId="0"'
+        attrs += ' applyFill="1"' if fill else ""
+        attrs += ' applyBorder="1"' if border else ""
+        attrs += ' applyAlignment="1"' if align else ""
+        xfs.append(f"<xf {attrs}>{align}</xf>" if align else f"<xf {attrs}/>")
+    return (
+        XML_DECL + f'<styleSheet xmlns="{MAIN_NS}">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/>'
+        '<family val="2"/></font></fonts>'
+        f'<fills count="{len(fills)}">{"".join(fills)}</fills>'
+        f'<borders count="{len(borders)}">{"".join(borders)}</borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" '
+        'borderId="0"/></cellStyleXfs>'
+        f'<cellXfs count="{len(xfs)}">{"".join(xfs)}</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/>'
+        "</cellStyles></styleSheet>"
+    )
+
+
+# ==== Sheet parts (worker side) ====
+
+
+def new_part():
+    # 1つのプロセスが作る行の XML と、その中だけで通し番号を振った共有文字列
+    return {"strings": [], "index": {}, "rows": []}
+
+
+def text_cell(part, ref, value, style):
+    if value == "" or value is None:
+        return f'<c r="{ref}" s="{style}"/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}" s="{style}"><v>{value}</v></c>'
+    value = str(value)
+    if value not in part["index"]:
+        part["index"][value] = len(part["strings"])
+        part["strings"].append(value)
+    return f'<c r="{ref}" s="{style}" t="s"><v>{part["index"][value]}</v></c>'
+
+
+def formula_cell(ref, formula, style):
+    return f'<c r="{ref}" s="{style}"><f>{escape(formula)}</f></c>'
+
+
+def rich_cell(ref, runs, style):
+    # runs: (文字列, 強調するか) の並び。書式付きの文字列は共有文字列にせずセルに直接書く
+    xml = "".join(
+        (f'<r><rPr><b/><color rgb="FF{HIGHLIGHT_TEXT}"/></rPr>' if bold else "<r>")
+        + f'<t xml:space="preserve">{escape(text)}</t></r>'
+        for text, bold in runs
+    )
+    return f'<c r="{ref}" s="{style}" t="inlineStr"><is>{xml}</is></c>'
+
+
+def add_row(part, r, cells):
+    part["rows"].append(f'<row r="{r}">{"".join(cells)}</row>')
+
+
+def render_blocks(job):
+    records, start_row, ctx = job
+    ids = ctx["ids"]
+    name_to_row = ctx["name_to_row"]
+    name_to_emp = ctx["name_to_emp"]
+    emp_aff_map = ctx["emp_aff_map"]
+    memo = {}
+    part = new_part()
+    col = get_column_letter
+    r = start_row
+    for rec in records:
+        cells = []
+        for j, val in enumerate(rec["hdr"], start=1):
+            wrap = not re.fullmatch(r"0[0-9]{1,}-[0-9]+-[0-9]{4}", val)
+            style = ids["header"] if wrap else ids["header_nowrap"]
+            cells.append(text_cell(part, f"{col(j)}{r}", val, style))
+        add_row(part, r, cells)
+
+        cells = []
+        for j, date_val in enumerate(rec["dr"], start=1):
+            sched_val = rec["sched"][j - 1] if j - 1 < len(rec["sched"]) else ""
+            if sched_val not in memo:
+                color = pref_color(sched_val, ctx["pref_rules"], FALLBACK)
+                memo[sched_val] = ids[("date", (color or "").upper())]
+            cells.append(text_cell(part, f"{col(j)}{r + 1}", date_val, memo[sched_val]))
+        add_row(part, r + 1, cells)
+
+        add_row(
+            part,
+            r + 2,
+            [
+                text_cell(part, f"{col(j)}{r + 2}", val, ids["wrap"])
+                for j, val in enumerate(rec["sched"], start=1)
+            ],
+        )
+
+        onb = rec.get("onb", [])
+        self_name = rec["hdr"][0]
+        if ctx["layout"] != "rows":
+            add_row(part, r + 3, onboard_cells(part, rec, r + 3, ctx))
+            r += 4
+            continue
+        max_onb = max((len(day) for day in onb if day), default=1)
+        for i in range(max_onb):
+            cells = []
+            for j, names in enumerate(onb, start=1):
+                ref = f"{col(j)}{r + 3 + i}"
+                value = names[i] if i < len(names) else ""
+                if value == self_name:
+                    value = ""
+                style = ids["wrap"]
+                emp = name_to_emp.get(value) if value else None
+                if emp and emp_aff_map.get(emp) == rec["aff"]:
+                    style = ids["highlight"]
+                target_row = name_to_row.get(value)
+                if value and target_row:
+                    cells.append(
+                        formula_cell(
+                            ref, f'HYPERLINK("#A{target_row}", "{value}")', style
+                        )
+                    )
+                else:
+                    cells.append(text_cell(part, ref, value, style))
+            add_row(part, r + 3 + i, cells)
+        r += 3 + max_onb
+    return "".join(part["rows"]), part["strings"]
+
+
+def onboard_cells(part, rec, r, ctx):
+    # compact / count の1行分（write_onboard_rows と同じ中身）
+    ids = ctx["ids"]
+    col = get_column_letter
+
+    def same_base(name):
+        emp = ctx["name_to_emp"].get(name)
+        return bool(emp) and ctx["emp_aff_map"].get(emp) == rec["aff"]
+
+    links = manifest_links(rec, ctx["manifest_at"]) if ctx["manifest_at"] else []
+    cells = []
+    for j, names in enumerate(rec.get("onb", []), start=1):
+        ref = f"{col(j)}{r}"
+        names = [n for n in names if n and n != rec["hdr"][0]]
+        if ctx["layout"] == "compact":
+            if any(same_base(n) for n in names):
+                runs = []
+                for k, name in enumerate(names):
+                    if k:
+                        runs.append(("\n", False))
+                    runs.append((name, same_base(name)))
+                cells.append(rich_cell(ref, runs, ids["wrap"]))
+            else:
+                cells.append(text_cell(part, ref, "\n".join(names), ids["wrap"]))
+            continue
+        style = ids["highlight" if any(same_base(n) for n in names) else "wrap"]
+        row = links[j - 1] if j - 1 < len(links) else None
+        if names and row:
+            formula = f"HYPERLINK(\"#'{MANIFEST_SHEET}'!A{row}\", {len(names)})"
+            cells.append(formula_cell(ref, formula, style))
+        else:
+            cells.append(text_cell(part, ref, len(names) or "", style))
+    return cells
+
+
+def render_table(rows):
+    part = new_part()
+    for r, values in enumerate(rows, start=1):
+        add_row(
+            part,
+            r,
+            [
+                text_cell(part, f"{get_column_letter(j)}{r}", v, 0)
+                for j, v in enumerate(values, start=1)
+            ],
+        )
+    return "".join(part["rows"]), part["strings"]
+
+
+def _render(job):
+    kind, payload = job
+    return render_blocks(payload) if kind == "blocks" else render_table(payload)
+
+
+# ==== Assembly ====
+
+
+def _sheet_xml(body, frozen=False):
+    view = (
+        '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" '
+        'topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+        "</sheetView></sheetViews>"
+        if frozen
+        else '<sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+    )
+    return (
+        XML_DECL + f"<worksheet {NS}>{view}"
+        f'<sheetFormatPr defaultRowHeight="15"/>'
+        f"<sheetData>{body}</sheetData></worksheet>"
+    )
+
+
+def merge_strings(parts):
+    # 各パートの共有文字列を出てきた順に1つにまとめ、セルの番号を付け替える
+    shared = []
+    index = {}
+    bodies = []
+    for body, strings in parts:
+        remap = []
+        for s in strings:
+            if s not in index:
+                index[s] = len(shared)
+                shared.append(s)
+            remap.append(index[s])
+        bodies.append(
+            re.sub(
+                r'( t="s"><v>)([0-9]+)(</v>)',
+                lambda m: f"{m.group(1)}{remap[int(m.group(2))]}{m.group(3)}",
+                body,
+            )
+        )
+    return bodies, shared
+
+
+def _sst_xml(shared):
+    items = "".join(f'<si><t xml:space="preserve">{escape(s)}</t></si>' for s in shared)
+    return (
+        XML_DECL + f'<sst xmlns="{MAIN_NS}" count="{len(shared)}" '
+        f'uniqueCount="{len(shared)}">{items}</sst>'
+    )
+
+
+def _package(path, sheets, shared, palette):
+    n = len(sheets)
+    content_types = (
+        XML_DECL
+        + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        + "".join(
+            f'<Override PartName="/xl/worksheets/sheet{k}.xml" ContentType="'
+            "application/vnd.openxmlformats-officedocument.spreadsheetml."
+            'worksheet+xml"/>'
+            for k in range(1, n + 1)
+        )
+        + '<Override PartName="/xl/styles.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        "</Types>"
+    )
+    rel = REL_NS
+    root_rels = (
+        XML_DECL
+        + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        f'relationships"><Relationship Id="rId1" Type="{rel}/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    )
+    workbook = (
+        XML_DECL
+        + f"<workbook {NS}><sheets>"
+        + "".join(
+            f'<sheet name="{escape(title)}" sheetId="{k}" r:id="rId{k}"/>'
+            for k, (title, _) in enumerate(sheets, start=1)
+        )
+        + "</sheets></workbook>"
+    )
+    wb_rels = (
+        XML_DECL
+        + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships">'
+        + "".join(
+            f'<Relationship Id="rId{k}" Type="{rel}/worksheet" '
+            f'Target="worksheets/sheet{k}.xml"/>'
+            for k in range(1, n + 1)
+        )
+        + f'<Relationship Id="rId{n + 1}" Type="{rel}/styles" Target="styles.xml"/>'
+        f'<Relationship Id="rId{n + 2}" Type="{rel}/sharedStrings" '
+        'Target="sharedStrings.xml"/></Relationships>'
+    )
+    parts = [
+        ("[Content_Types].xml", content_types),
+        ("_rels/.rels", root_rels),
+        ("xl/workbook.xml", workbook),
+        ("xl/_rels/workbook.xml.rels", wb_rels),
+        ("xl/styles.xml", styles_xml(palette)),
+        ("xl/sharedStrings.xml", _sst_xml(shared)),
+    ]
+    parts += [
+        (f"xl/worksheets/sheet{k}.xml", xml) for k, (_, xml) in enumerate(sheets, 1)
+    ]
+    # 時刻を固定して、同じ入力なら同じバイト列になるようにする
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in parts:
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            z.writestr(info, data)
+
+
+def write_workbook_parallel(
+    records,
+    emp_aff_map,
+    out_xlsx,
+    pref_rules,
+    sheets=(),
+    workers=None,
+    chunk=50,
+    onboard_layout="rows",
+    manifest_at=None,
+):
+    # write_to_excel と同じ見た目のブックを、chunk 人ずつの行範囲に分けて並列に作る
+    palette = build_palette(pref_rules)
+    name_to_row = block_rows(records, onboard_layout)
+    ctx = {
+        "ids": style_ids(palette),
+        "name_to_row": name_to_row,
+        "name_to_emp": {rec["hdr"][0]: rec["emp_no"] for rec in records},
+        "emp_aff_map": emp_aff_map,
+        "pref_rules": pref_rules,
+        "layout": onboard_layout,
+        "manifest_at": manifest_at,
+    }
+    jobs = []
+    start = 1
+    for k in range(0, len(records), chunk):
+        part = records[k : k + chunk]
+        jobs.append(("blocks", (part, start, ctx)))
+        if onboard_layout == "rows":
+            start += sum(
+                3 + max((len(d) for d in rec.get("onb", []) if d), default=1)
+                for rec in part
+            )
+        else:
+            start += 4 * len(part)
+    jobs += [("table", rows) for _, rows in sheets]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_render, jobs))
+    bodies, shared = merge_strings(parts)
+    n_block = len(jobs) - len(sheets)
+    out = [("Sheet", _sheet_xml("".join(bodies[:n_block])))]
+    for (title, _), body in zip(sheets, bodies[n_block:]):
+        out.append((title, _sheet_xml(body, frozen=True)))
+    _package(out_xlsx, out, shared, palette)
+    return out_xlsx